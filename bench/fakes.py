@@ -0,0 +1,115 @@
+"""Generadores de playlists sintéticas y upstreams falsos (TMDB, dixmax, origen HLS).
+
+Los upstreams son un ``httpx.MockTransport`` asíncrono: corren en el mismo
+proceso, con latencia configurable e inyección de errores.
+"""
+import random
+import asyncio
+
+import httpx
+
+RESOLUTIONS = [(426, 240), (640, 360), (854, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+LANGUAGES = ["es", "en", "lat", "fr", "de", "it", "jp", "pt"]
+
+
+def make_master(lines: int) -> str:
+    """Master con ~``lines`` líneas: pistas de audio y variantes relativas."""
+    out = ["#EXTM3U", "#EXT-X-VERSION:6", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    audio = min(len(LANGUAGES), lines // 10)
+    for lang in LANGUAGES[:audio]:
+        out.append(f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",LANGUAGE="{lang}",NAME="{lang}",URI="audio/{lang}/index.m3u8"')
+
+    i = 0
+    while len(out) + 2 <= max(lines, 5):
+        width, height = RESOLUTIONS[i % len(RESOLUTIONS)]
+        bandwidth = 400000 + i * 150000
+        out.append(
+            f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},AVERAGE-BANDWIDTH={bandwidth * 9 // 10},'
+            f'RESOLUTION={width}x{height},CODECS="avc1.640028,mp4a.40.2",AUDIO="aud"'
+        )
+        out.append(f"video/{height}p_{i}/index.m3u8")
+        i += 1
+    return "\n".join(out) + "\n"
+
+
+def make_media(lines: int) -> str:
+    """Media playlist VOD con ~``lines`` líneas: clave, segmentos de 4 s y ENDLIST."""
+    out = [
+        "#EXTM3U", "#EXT-X-VERSION:6", "#EXT-X-TARGETDURATION:4", "#EXT-X-PLAYLIST-TYPE:VOD",
+        '#EXT-X-KEY:METHOD=AES-128,URI="../keys/key.bin"', '#EXT-X-MAP:URI="init.mp4"',
+    ]
+    i = 0
+    while len(out) + 3 <= max(lines, 5):
+        out.append("#EXTINF:4.000,")
+        out.append(f"seg_{i:05d}.m4s")
+        i += 1
+    out.append("#EXT-X-ENDLIST")
+    return "\n".join(out) + "\n"
+
+
+def master_bandwidths(content: str):
+    return [int(line.split("BANDWIDTH=", 1)[1].split(",", 1)[0])
+            for line in content.splitlines() if line.startswith("#EXT-X-STREAM-INF")]
+
+
+class FakeUpstreams:
+    """Responde como TMDB, dixmax y el origen HLS a partir del host de la URL.
+
+    ``latency`` (s) se aplica a cada petición con un ±``jitter`` relativo y
+    ``error_rate`` es la probabilidad de devolver un 503.
+    """
+
+    def __init__(self, latency: float = 0.02, jitter: float = 0.5, error_rate: float = 0.0,
+                 master_lines: int = 40, links_per_title: int = 2, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.links_per_title = links_per_title
+        self.master = make_master(master_lines)
+        self.media = make_media(400)
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * (1 + self.jitter * (2 * self.random.random() - 1)))
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            return httpx.Response(503)
+
+        host, path = request.url.host, request.url.path
+        if host == "api.themoviedb.org":
+            return self._tmdb(path)
+        if "/get/login/" in path:
+            return httpx.Response(200, json={"result": {"sid": "bench-sid"}})
+        if "/get/hash_link_v5/" in path:
+            media_id = path.rstrip("/").split("/")[-1]
+            return httpx.Response(200, json={"data": [
+                f"https://origin.bench/{media_id}/{n}/master.m3u8" for n in range(self.links_per_title)
+            ]})
+        if host == "origin.bench":
+            if path.endswith("master.m3u8"):
+                return httpx.Response(200, text=self.master, headers={"content-type": "application/vnd.apple.mpegurl"})
+            if path.endswith(".m3u8"):
+                return httpx.Response(200, text=self.media, headers={"content-type": "application/vnd.apple.mpegurl"})
+            return httpx.Response(200, content=b"\0" * 188 * 64, headers={"content-type": "video/mp2t"})
+        return httpx.Response(404)
+
+    def _tmdb(self, path: str) -> httpx.Response:
+        if path.startswith("/3/find/"):
+            imdb_id = path.rsplit("/", 1)[-1]
+            tmdb_id = int("".join(c for c in imdb_id if c.isdigit()) or 0)
+            return httpx.Response(200, json={
+                "movie_results": [{"id": tmdb_id, "title": f"Película {imdb_id}", "release_date": "2020-01-01"}],
+                "tv_results": [{"id": tmdb_id, "name": f"Serie {imdb_id}"}],
+            })
+        if "/season/" in path:
+            return httpx.Response(200, json={"runtime": 45, "episodes": [
+                {"episode_number": n, "runtime": 45} for n in range(1, 25)
+            ]})
+        return httpx.Response(200, json={"runtime": 110, "episode_run_time": [45]})
@@ -0,0 +1,131 @@
+"""Implementaciones anteriores de los caminos calientes, solo para comparar en los benchmarks.
+
+``parse_manifest_to_qualities`` es la versión previa al parser compartido de
+``utils.hls_parser``: ``re.findall`` sobre todo el manifiesto, dos
+``re.search`` por variante y un dict de emojis reconstruido en cada llamada.
+``_cpu_bound_rewrite`` es la reescritura sobre texto con un ``urljoin`` por URI.
+"""
+import re
+import logging
+from urllib.parse import quote, urljoin
+
+ADDON_URL = "http://addon.bench"
+logger = logging.getLogger(__name__)
+
+def get_emoji(lang_code):
+    lang_code = lang_code.lower().strip()
+    mapping = {
+        "en": "🇬🇧", "eng": "🇬🇧", "english": "🇬🇧",
+        "es": "🇪🇸", "spa": "🇪🇸", "spanish": "🇪🇸", "castellano": "🇪🇸",
+        "lat": "🇲🇽", "mx": "🇲🇽", "latino": "🇲🇽", "et": "🇲🇽",
+        "jp": "🇯🇵", "jpn": "🇯🇵",
+        "fr": "🇫🇷", "fra": "🇫🇷",
+        "it": "🇮🇹", "ita": "🇮🇹",
+        "de": "🇩🇪", "deu": "🇩🇪",
+        "pt": "🇵🇹", "por": "🇵🇹",
+        "ru": "🇷🇺", "rus": "🇷🇺",
+        "multi": "🌎"
+    }
+    return mapping.get(lang_code, "")
+
+def parse_manifest_to_qualities(master_url: str, content_title: str, duration: float, content: str):
+    try:
+        lines = content.split('\n')
+        streams_found = []
+        
+        audio_langs = re.findall(r'TYPE=AUDIO.*LANGUAGE="?(\w+)"?', content)
+        unique_langs = list(set(audio_langs))
+        emojis = [get_emoji(l) for l in unique_langs if get_emoji(l)]
+        flags_str = " / ".join(emojis) if emojis else "🇪🇸"
+
+        base_addon_url = str(ADDON_URL).rstrip('/')
+
+        for i, line in enumerate(lines):
+            line = line.strip()
+            
+            if line.startswith("#EXT-X-STREAM-INF"):
+                res_match = re.search(r'RESOLUTION=\d+x(\d+)', line)
+                bw_match = re.search(r'BANDWIDTH=(\d+)', line)
+                
+                height = int(res_match.group(1)) if res_match else 0
+                bandwidth = int(bw_match.group(1)) if bw_match else 0
+                
+                if bandwidth > 0:
+                    quality_label = f"{height}p" if height > 0 else "Auto"
+                    
+                    size_info = ""
+                    if duration > 0:
+                        size_bits = bandwidth * (duration * 60)
+                        size_gb = size_bits / 8 / (1024 ** 3)
+                        size_info = f"💾 {size_gb:.2f}GB "
+
+                    spacer = "\u2800" * 2
+                    name_formatted = f"NDKMAX{spacer} {quality_label}"
+                    title_formatted = f"{content_title} - {quality_label}\n{size_info}\n{flags_str}"
+                    
+                    generated_url = f"{base_addon_url}/proxy/filter?url={quote(master_url)}&bw={bandwidth}"
+
+                    stream_entry = {
+                        "name": name_formatted,
+                        "title": title_formatted,
+                        "url": generated_url,
+                        "behaviorHints": {
+                            "notWebReady": False,
+                            "bingeGroup": f"NDK-MAX-{quality_label}",
+                        }
+                    }
+                    streams_found.append(stream_entry)
+
+        if not streams_found:
+             return [{
+                "name": "NDKMAX Default",
+                "title": f"{content_title}\nUnknown Quality {flags_str}",
+                "url": master_url
+            }]
+
+        streams_found.sort(key=lambda x: int(x['name'].split()[-1].replace('p', '')) if 'p' in x['name'] else 0, reverse=True)
+        return streams_found
+
+    except Exception as e:
+        logger.error(f"Error parseando HLS streams: {e}")
+        return []
+
+def _is_url(line):
+    return line and not line.startswith("#") and len(line.strip()) > 0
+
+def _cpu_bound_rewrite(content, base_url):
+    lines = content.splitlines()
+    rewritten_lines = []
+    rewrite_count = 0
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            rewritten_lines.append(line)
+            continue
+
+        if line.startswith("#") and 'URI="' in line:
+            try:
+                start_idx = line.find('URI="') + 5
+                end_idx = line.find('"', start_idx)
+                if start_idx > 4 and end_idx > start_idx:
+                    relative_uri = line[start_idx:end_idx]
+                    absolute_url = urljoin(base_url, relative_uri)
+                    
+                    new_uri = absolute_url
+                    
+                    line = line[:start_idx] + new_uri + line[end_idx:]
+                    rewrite_count += 1
+            except Exception:
+                pass
+            rewritten_lines.append(line)
+
+        elif _is_url(line):
+            absolute_url = urljoin(base_url, line)
+            rewritten_lines.append(absolute_url)
+            rewrite_count += 1
+        
+        else:
+            rewritten_lines.append(line)
+    
+    return "\n".join(rewritten_lines), rewrite_count
@@ -0,0 +1,149 @@
+"""Prueba de carga de /stream y /proxy/filter contra upstreams falsos en el mismo proceso.
+
+La app se ejecuta con ``httpx.ASGITransport`` y su cliente HTTP se sustituye
+por uno que habla con ``FakeUpstreams``, así que no sale nada a la red.
+
+Uso (desde la raíz del repo):
+    python -m bench.load [--requests 2000] [--concurrency 50] [--titles 200] [--clients 500]
+                         [--latency-ms 20] [--error-rate 0.0] [--master-lines 40]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+from urllib.parse import urlsplit
+
+import httpx
+
+from bench.fakes import FakeUpstreams
+
+
+def configure_env(workdir: str):
+    # config.py lee el entorno al importarse: hay que fijarlo antes de cargar main
+    os.environ.update({
+        "PERFIL_BENCH": "bench:bench",
+        "URL_BASE": "https://dixmax.bench",
+        "APP_KEY": "bench",
+        "AUTH_STR": "bench",
+        "TMDB_KEY": "bench",
+        "ADDON_URL": "http://addon.bench",
+        "NODE_ENV": "development",
+        "LINK_CACHE_PATH": os.path.join(workdir, "links.db"),
+        "CACHE_DB_PATH": os.path.join(workdir, "cache.db"),
+        # ASGITransport conecta desde 127.0.0.1: hace de proxy de confianza con X-Forwarded-For
+        "TRUSTED_PROXIES": "127.0.0.1",
+    })
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        value = samples[0] if samples else 0.0
+        return value, value, value
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return q[49], q[94], q[98]
+
+
+def report(name, latencies, statuses, elapsed):
+    ok = sum(1 for s in statuses if s < 400)
+    p50, p95, p99 = percentiles(latencies)
+    print(
+        f"{name:<14}{len(latencies):>8}{ok:>8}{len(latencies) / elapsed:>10.1f}"
+        f"{p50 * 1000:>10.2f}{p95 * 1000:>10.2f}{p99 * 1000:>10.2f}"
+    )
+
+
+async def run(args):
+    import main as app_main
+
+    upstreams = FakeUpstreams(
+        latency=args.latency_ms / 1000, error_rate=args.error_rate,
+        master_lines=args.master_lines, seed=args.seed,
+    )
+    app_main.http_client = httpx.AsyncClient(transport=upstreams.transport(), follow_redirects=True)
+    app_main.metadata_provider.provider.http_client = app_main.http_client
+    app_main.link_validator.client = app_main.http_client
+
+    await app_main.startup_event()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app_main.app), base_url="http://addon.bench")
+
+    rng = random.Random(args.seed)
+    # Distribución sesgada: unos pocos títulos concentran la mayoría de peticiones
+    titles = [f"tt{1000000 + i}" for i in range(args.titles)]
+    weights = [1 / (i + 1) for i in range(args.titles)]
+    results = {"stream": ([], []), "proxy/filter": ([], [])}
+    filter_urls = []
+    queue = asyncio.Queue()
+    for _ in range(args.requests):
+        queue.put_nowait(rng.random())
+
+    async def one(kind, url):
+        # Cada petición llega desde uno de --clients espectadores, como tras el proxy de producción
+        viewer = rng.randrange(args.clients)
+        headers = {"X-Forwarded-For": f"10.{viewer >> 16 & 255}.{viewer >> 8 & 255}.{viewer & 255}"}
+        start = time.perf_counter()
+        resp = await client.get(url, headers=headers)
+        latencies, statuses = results[kind]
+        latencies.append(time.perf_counter() - start)
+        statuses.append(resp.status_code)
+        return resp
+
+    async def worker():
+        while not queue.empty():
+            roll = queue.get_nowait()
+            if filter_urls and roll < args.filter_ratio:
+                await one("proxy/filter", rng.choice(filter_urls))
+                continue
+
+            title = rng.choices(titles, weights)[0]
+            if rng.random() < 0.5:
+                url = f"/stream/movie/{title}.json"
+            else:
+                url = f"/stream/series/{title}:1:{rng.randint(1, 10)}.json"
+            resp = await one("stream", url)
+            if resp.status_code == 200:
+                for stream in resp.json().get("streams", []):
+                    target = urlsplit(stream.get("url", ""))
+                    if target.path.endswith("/proxy/filter"):
+                        filter_urls.append(f"{target.path}?{target.query}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{'endpoint':<14}{'total':>8}{'ok':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, (latencies, statuses) in results.items():
+        report(kind, latencies, statuses, elapsed)
+    print(f"\nupstream: {upstreams.requests} peticiones, {upstreams.errors} errores inyectados, {elapsed:.2f}s")
+
+    await client.aclose()
+    await app_main.shutdown_event()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--titles", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--master-lines", type=int, default=40)
+    parser.add_argument("--filter-ratio", type=float, default=0.6,
+                        help="fracción de peticiones a /proxy/filter una vez hay URLs disponibles")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ndkmax-bench-")
+    configure_env(workdir)
+    logging.disable(logging.CRITICAL)
+    sys.path.insert(0, os.getcwd())
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
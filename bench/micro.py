@@ -0,0 +1,78 @@
+"""Microbenchmarks de los caminos calientes sobre playlists sintéticas de 5 a 5.000 líneas.
+
+Uso (desde la raíz del repo):
+    python -m bench.micro [--sizes 5,50,500,5000] [--min-time 0.2]
+"""
+import time
+import logging
+import argparse
+
+from bench import legacy
+from bench.fakes import make_master, make_media, master_bandwidths
+from utils.cache import TTLCache
+from utils.hls_parser import parse_master
+from utils.hls_proxy import _cpu_bound_rewrite, filter_manifest_by_quality, MasterPlaylist
+from utils.stremio_parser import parse_manifest_to_qualities
+
+BASE_URL = "https://origin.bench/title/0/master.m3u8"
+
+
+def measure(fn, min_time: float) -> float:
+    """Devuelve el tiempo medio por llamada (s), repitiendo hasta ``min_time`` segundos."""
+    fn()
+    runs, start = 0, time.perf_counter()
+    while True:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / runs
+
+
+def bench_cache(n: int):
+    cache = TTLCache(maxsize=n // 2, ttl=3600, max_bytes=n * 1024, sizeof=len)
+    payload = "x" * 1500
+    keys = [f"https://origin.bench/{i}/master.m3u8" for i in range(n)]
+
+    def run():
+        for key in keys:
+            cache.set(key, payload)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="5,50,500,5000")
+    parser.add_argument("--min-time", type=float, default=0.2)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    print(f"{'caso':<38}{'líneas':>8}{'µs/op':>12}")
+
+    for lines in sizes:
+        master = make_master(lines).encode()
+        media = make_media(lines).encode()
+        rewritten, _ = _cpu_bound_rewrite(master, BASE_URL)
+        bandwidth = master_bandwidths(rewritten)[-1]
+        playlist = MasterPlaylist(rewritten)
+
+        cases = [
+            ("_cpu_bound_rewrite (master)", lambda: _cpu_bound_rewrite(master, BASE_URL)),
+            ("_cpu_bound_rewrite (media)", lambda: _cpu_bound_rewrite(media, BASE_URL)),
+            ("_cpu_bound_rewrite (media, ant.)", lambda: legacy._cpu_bound_rewrite(media.decode(), BASE_URL)),
+            ("filter_manifest_by_quality", lambda: filter_manifest_by_quality(rewritten, bandwidth)),
+            ("MasterPlaylist.render (memo)", lambda: playlist.render(bandwidth)),
+            ("parse_manifest_to_qualities", lambda: parse_manifest_to_qualities(BASE_URL, "Título", 110, rewritten)),
+            ("parse_manifest_to_qualities (ant.)", lambda: legacy.parse_manifest_to_qualities(BASE_URL, "Título", 110, rewritten)),
+            ("parse_master (solo parser)", lambda: parse_master(rewritten)),
+            ("parse_manifest_to_qualities (parsed=)",
+             lambda: parse_manifest_to_qualities(BASE_URL, "Título", 110, rewritten, parsed=playlist.parsed)),
+            ("TTLCache.set con expulsión", bench_cache(lines)),
+        ]
+        for name, fn in cases:
+            print(f"{name:<38}{lines:>8}{measure(fn, args.min_time) * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
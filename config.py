@@ -1,4 +1,6 @@
 import os
+import hashlib
+import secrets
 from dotenv import load_dotenv, dotenv_values
 
 # --- Constantes de configuración ---
@@ -16,5 +18,132 @@ URL_BASE = os.getenv("URL_BASE")
 APP_KEY = os.getenv("APP_KEY")
 AUTH_STR = os.getenv("AUTH_STR")
 
+# Caché de metadatos (TMDB)
+METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", 6 * 3600))
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", 5000))
+
+# Backend de caché: "memory" (un proceso) o "sqlite" (compartida entre workers de uvicorn)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite" if int(os.getenv("WEB_CONCURRENCY", 1)) > 1 else "memory")
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache.db")
+# Con el backend compartido, lo que tarda como mucho un borrado en verse en los demás workers
+SHARED_CACHE_LOCAL_TTL = float(os.getenv("SHARED_CACHE_LOCAL_TTL", 60))
+
+# Caché de masters reescritos (límite en bytes, TTL para que caduquen las URLs firmadas)
+MANIFEST_CACHE_TTL = int(os.getenv("MANIFEST_CACHE_TTL", 3 * 3600))
+MANIFEST_CACHE_MAX_BYTES = int(os.getenv("MANIFEST_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+MANIFEST_CACHE_MAX_ENTRIES = int(os.getenv("MANIFEST_CACHE_MAX_ENTRIES", 20000))
+# Masters populares (al menos N aciertos) se revalidan en segundo plano al consumir esta
+# fracción de su TTL, con GET condicional (ETag/Last-Modified) para que un 304 no cueste nada
+MANIFEST_REFRESH_AHEAD = float(os.getenv("MANIFEST_REFRESH_AHEAD", 0.8))
+MANIFEST_REFRESH_MIN_HITS = int(os.getenv("MANIFEST_REFRESH_MIN_HITS", 3))
+
+# Pools de conexiones por upstream: conexiones máximas y timeout total (s) de cada clase;
+# el de los CDN es por host conocido. HTTP/2 solo para los hosts listados (requiere el paquete h2)
+UPSTREAM_TMDB_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_TMDB_MAX_CONNECTIONS", 50))
+UPSTREAM_TMDB_TIMEOUT = float(os.getenv("UPSTREAM_TMDB_TIMEOUT", 8))
+UPSTREAM_DIXMAX_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_DIXMAX_MAX_CONNECTIONS", 100))
+UPSTREAM_DIXMAX_TIMEOUT = float(os.getenv("UPSTREAM_DIXMAX_TIMEOUT", 15))
+UPSTREAM_CDN_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_CDN_MAX_CONNECTIONS", 50))
+UPSTREAM_CDN_TIMEOUT = float(os.getenv("UPSTREAM_CDN_TIMEOUT", 15))
+UPSTREAM_HTTP2_HOSTS = {host.strip() for host in os.getenv("UPSTREAM_HTTP2_HOSTS", "").split(",") if host.strip()}
+# Hosts de CDN con etiqueta de métricas propia: los listados y, hasta el máximo, los que
+# aparecen en los enlaces de dixmax; cualquier otro se agrupa como "cdn:other"
+UPSTREAM_CDN_HOSTS = {host.strip() for host in os.getenv("UPSTREAM_CDN_HOSTS", "").split(",") if host.strip()}
+UPSTREAM_CDN_MAX_HOSTS = int(os.getenv("UPSTREAM_CDN_MAX_HOSTS", 50))
+DNS_CACHE_TTL = float(os.getenv("DNS_CACHE_TTL", 300))
+
+# Caché negativa: cuánto (s) se recuerda cada tipo de fallo y capacidad/tasa de falsos
+# positivos de sus filtros de Bloom
+NEGATIVE_TTL_NOT_FOUND = float(os.getenv("NEGATIVE_TTL_NOT_FOUND", 3600))
+NEGATIVE_TTL_EMPTY_LINKS = float(os.getenv("NEGATIVE_TTL_EMPTY_LINKS", 900))
+NEGATIVE_TTL_UPSTREAM_ERROR = float(os.getenv("NEGATIVE_TTL_UPSTREAM_ERROR", 60))
+NEGATIVE_CACHE_CAPACITY = int(os.getenv("NEGATIVE_CACHE_CAPACITY", 1000000))
+NEGATIVE_CACHE_ERROR_RATE = float(os.getenv("NEGATIVE_CACHE_ERROR_RATE", 0.001))
+
+# Caché persistente de enlaces de dixmax (SQLite, sobrevive a reinicios)
+LINK_CACHE_PATH = os.getenv("LINK_CACHE_PATH", "link_cache.db")
+LINK_CACHE_TTL = int(os.getenv("LINK_CACHE_TTL", 7 * 24 * 3600))
+LINK_CACHE_SIZE = int(os.getenv("LINK_CACHE_SIZE", 50000))
+LINK_CACHE_FLUSH_INTERVAL = float(os.getenv("LINK_CACHE_FLUSH_INTERVAL", 5))
+
+# Validador de enlaces: lotes por minuto, concurrencia total y peticiones/s por host
+LINK_VALIDATOR_BATCH = int(os.getenv("LINK_VALIDATOR_BATCH", 200))
+LINK_VALIDATOR_CONCURRENCY = int(os.getenv("LINK_VALIDATOR_CONCURRENCY", 20))
+LINK_VALIDATOR_HOST_RATE = float(os.getenv("LINK_VALIDATOR_HOST_RATE", 5))
+
+# Modo proxy: las media playlists, segmentos y claves también pasan por el addon
+PROXY_MODE = os.getenv("PROXY_MODE", "false").lower() in ("1", "true", "yes")
+MEDIA_PLAYLIST_CACHE_TTL = float(os.getenv("MEDIA_PLAYLIST_CACHE_TTL", 10))
+MEDIA_PLAYLIST_CACHE_SIZE = int(os.getenv("MEDIA_PLAYLIST_CACHE_SIZE", 2000))
+MEDIA_PLAYLIST_CACHE_MAX_BYTES = int(os.getenv("MEDIA_PLAYLIST_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+SEGMENT_CHUNK_SIZE = int(os.getenv("SEGMENT_CHUNK_SIZE", 64 * 1024))
+# Clave con la que se firman las URLs de /proxy/*; sin firma válida se responde 403. Tiene que
+# ser la misma en todos los workers: si no se define se deriva de las credenciales de dixmax
+PROXY_SECRET = os.getenv("PROXY_SECRET") or (
+    hashlib.sha256(f"ndkmax-proxy:{APP_KEY}:{AUTH_STR}".encode()).hexdigest()
+    if APP_KEY or AUTH_STR else secrets.token_hex(32)
+)
+
+# Reescritura de playlists: hasta este tamaño se hace en el bucle, por encima en un pool propio
+REWRITE_INLINE_MAX_BYTES = int(os.getenv("REWRITE_INLINE_MAX_BYTES", 64 * 1024))
+REWRITE_WORKERS = int(os.getenv("REWRITE_WORKERS", 2))
+
+# Nivel gzip de los artefactos cacheados (masters, variantes filtradas y respuestas de /stream)
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", 6))
+
+# Logging: nivel global, niveles por módulo ("utils.dixmax=DEBUG,main=WARNING"),
+# formato ("color" o "json") y ventana de muestreo (s) de los eventos frecuentes
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG" if IS_DEV else "INFO").upper()
+LOG_LEVELS = {
+    name.strip(): level.strip().upper()
+    for name, _, level in (item.partition("=") for item in os.getenv("LOG_LEVELS", "").split(","))
+    if level
+}
+LOG_FORMAT = os.getenv("LOG_FORMAT", "color").lower()
+LOG_SAMPLE_INTERVAL = float(os.getenv("LOG_SAMPLE_INTERVAL", 10))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+# Plazo máximo (s) para responder a /stream; se devuelven los streams listos a tiempo
+STREAM_DEADLINE = float(os.getenv("STREAM_DEADLINE", 10))
+
+# Caché de respuestas de /stream: frescas durante STREAM_CACHE_FRESH, luego se sirven
+# mientras se refrescan en segundo plano, hasta STREAM_CACHE_TTL como máximo
+STREAM_CACHE_FRESH = float(os.getenv("STREAM_CACHE_FRESH", 15 * 60))
+STREAM_CACHE_TTL = int(os.getenv("STREAM_CACHE_TTL", 24 * 3600))
+STREAM_CACHE_SIZE = int(os.getenv("STREAM_CACHE_SIZE", 10000))
+
+# Precalentamiento por lotes: fichero de títulos (vacío desactiva la tarea programada),
+# cuándo se ejecuta, concurrencia y ficheros de progreso (para reanudar) e informe
+WARM_TARGETS_PATH = os.getenv("WARM_TARGETS_PATH", "")
+WARM_CRON = os.getenv("WARM_CRON", "30 5 * * *")
+WARM_CONCURRENCY = int(os.getenv("WARM_CONCURRENCY", 2))
+WARM_STATE_PATH = os.getenv("WARM_STATE_PATH", "warm_state.jsonl")
+WARM_REPORT_PATH = os.getenv("WARM_REPORT_PATH", "warm_report.json")
+
+# Control de admisión de las peticiones que van al upstream (fallos de caché): peticiones
+# simultáneas y en espera por endpoint, espera máxima (s) y peticiones/s (con ráfaga) por IP
+ADMISSION_STREAM_CONCURRENCY = int(os.getenv("ADMISSION_STREAM_CONCURRENCY", 50))
+ADMISSION_STREAM_QUEUE = int(os.getenv("ADMISSION_STREAM_QUEUE", 100))
+ADMISSION_FILTER_CONCURRENCY = int(os.getenv("ADMISSION_FILTER_CONCURRENCY", 100))
+ADMISSION_FILTER_QUEUE = int(os.getenv("ADMISSION_FILTER_QUEUE", 200))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5))
+CLIENT_RATE = float(os.getenv("CLIENT_RATE", 2))
+CLIENT_BURST = int(os.getenv("CLIENT_BURST", 20))
+# Proxies propios (IPs o redes separadas por comas) de los que se acepta X-Forwarded-For;
+# sin ellos cada cliente se identifica por la IP de la conexión
+TRUSTED_PROXIES = [proxy.strip() for proxy in os.getenv("TRUSTED_PROXIES", "").split(",") if proxy.strip()]
+
+# Precarga de los siguientes episodios tras pedir uno de una serie
+PREFETCH_EPISODES = int(os.getenv("PREFETCH_EPISODES", 2))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", 2))
+PREFETCH_QUEUE_SIZE = int(os.getenv("PREFETCH_QUEUE_SIZE", 200))
+
+# Reparto entre perfiles: llamadas simultáneas a hash_link_v5 por perfil, espera máxima
+# (s) cuando todos están ocupados y cortocircuito tras N fallos seguidos durante X segundos
+PROFILE_MAX_CONCURRENCY = int(os.getenv("PROFILE_MAX_CONCURRENCY", 4))
+PROFILE_QUEUE_TIMEOUT = float(os.getenv("PROFILE_QUEUE_TIMEOUT", 10))
+PROFILE_BREAKER_FAILURES = int(os.getenv("PROFILE_BREAKER_FAILURES", 3))
+PROFILE_BREAKER_COOLDOWN = float(os.getenv("PROFILE_BREAKER_COOLDOWN", 30))
+
 # Perfiles
 PERFILES = {key: value for key, value in os.environ.items() if key.startswith("PERFIL")}
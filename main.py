@@ -1,31 +1,116 @@
-import httpx
+import json
 import time
+import httpx
+import asyncio
 from aiocron import crontab
-from urllib.parse import unquote, quote
-from fastapi import FastAPI, Response 
+from urllib.parse import quote, urlsplit
+from fastapi import FastAPI, Request, Response, Header
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 import state
 from metadata.tmdb import TMDB
-from utils.logger import setup_logger
+from metadata.cache import CachedMetadataProvider
+from utils.logger import setup_logger, dropped_records
+from utils.cache import TTLCache, SingleFlight
+from utils.cache_backend import make_cache, acquire_leader_lock
+from utils.link_store import LinkStore
+from utils.link_validator import LinkValidator
+from utils.prefetch import Prefetcher
+from utils.admission import AdmissionController, ClientRateLimiter, Overloaded, TrustedProxies
+from utils.negative_cache import NegativeCache
+from utils.warmer import CacheWarmer, parse_targets, expand_targets
+from utils.upstreams import KnownHosts, UpstreamPool, UpstreamTransport
+from utils.metrics import REGISTRY, InstrumentedTransport, MetricsMiddleware, monitor_loop_lag
 from utils.stremio_parser import parse_manifest_to_qualities
-from utils.dixmax import GestorPerfiles, Perfil, obtener_enlace
-from utils.hls_proxy import fetch_and_rewrite_manifest, filter_manifest_by_quality
-from config import PERFILES, ROOT_PATH, IS_DEV, VERSION, ADDON_URL
+from utils.dixmax import GestorPerfiles, SinPerfiles, crear_perfiles, obtener_enlace
+from utils.hls_proxy import fetch_and_rewrite_manifest, open_segment, MasterPlaylist, SEGMENT_HEADERS
+from utils.compression import compress, decompress, accepts_gzip
+from utils.signing import verify_url
+from config import URL_BASE
+from config import PERFILES, ROOT_PATH, IS_DEV, VERSION, ADDON_URL, METADATA_CACHE_TTL, METADATA_CACHE_SIZE, STREAM_DEADLINE
+from config import PREFETCH_EPISODES, PREFETCH_CONCURRENCY, PREFETCH_QUEUE_SIZE
+from config import ADMISSION_STREAM_CONCURRENCY, ADMISSION_STREAM_QUEUE, ADMISSION_FILTER_CONCURRENCY, ADMISSION_FILTER_QUEUE
+from config import ADMISSION_QUEUE_TIMEOUT, CLIENT_RATE, CLIENT_BURST, TRUSTED_PROXIES
+from config import WARM_TARGETS_PATH, WARM_CRON, WARM_CONCURRENCY, WARM_STATE_PATH, WARM_REPORT_PATH
+from config import STREAM_CACHE_TTL, STREAM_CACHE_FRESH, STREAM_CACHE_SIZE
+from config import CACHE_BACKEND, CACHE_DB_PATH, SHARED_CACHE_LOCAL_TTL
+from config import MANIFEST_CACHE_TTL, MANIFEST_CACHE_MAX_BYTES, MANIFEST_CACHE_MAX_ENTRIES
+from config import MANIFEST_REFRESH_AHEAD, MANIFEST_REFRESH_MIN_HITS
+from config import UPSTREAM_TMDB_MAX_CONNECTIONS, UPSTREAM_TMDB_TIMEOUT, UPSTREAM_DIXMAX_MAX_CONNECTIONS, UPSTREAM_DIXMAX_TIMEOUT
+from config import UPSTREAM_CDN_MAX_CONNECTIONS, UPSTREAM_CDN_TIMEOUT, UPSTREAM_HTTP2_HOSTS, DNS_CACHE_TTL
+from config import UPSTREAM_CDN_HOSTS, UPSTREAM_CDN_MAX_HOSTS
+from config import NEGATIVE_TTL_NOT_FOUND, NEGATIVE_TTL_EMPTY_LINKS, NEGATIVE_TTL_UPSTREAM_ERROR
+from config import NEGATIVE_CACHE_CAPACITY, NEGATIVE_CACHE_ERROR_RATE
+from config import LINK_CACHE_PATH, LINK_CACHE_TTL, LINK_CACHE_SIZE, LINK_CACHE_FLUSH_INTERVAL
+from config import LINK_VALIDATOR_CONCURRENCY, LINK_VALIDATOR_HOST_RATE, LINK_VALIDATOR_BATCH
+from config import PROXY_MODE, MEDIA_PLAYLIST_CACHE_TTL, MEDIA_PLAYLIST_CACHE_SIZE, MEDIA_PLAYLIST_CACHE_MAX_BYTES, SEGMENT_CHUNK_SIZE
 
 logger = setup_logger(__name__)
 
-limits = httpx.Limits(max_keepalive_connections=100, max_connections=500, keepalive_expiry=30)
 timeout = httpx.Timeout(15.0, connect=5.0)
 
+DIXMAX_HOST = urlsplit(URL_BASE or "").hostname
+ADDON_HOST = urlsplit(ADDON_URL or "").hostname
+CDN_HOSTS = KnownHosts(UPSTREAM_CDN_HOSTS, UPSTREAM_CDN_MAX_HOSTS)
+
+def trust_cdn_host(url: str):
+    # Solo llegan aquí URLs de dixmax o firmadas por el addon, nunca las que elige un cliente
+    CDN_HOSTS.add(urlsplit(url).hostname)
+
+def classify_upstream(url: httpx.URL) -> str:
+    # Etiqueta de upstream para las métricas de latencia
+    if url.host == "api.themoviedb.org":
+        return "tmdb"
+    if url.host == DIXMAX_HOST:
+        if "/hash_link_v5/" in url.path:
+            return "dixmax_hash_link"
+        if "/login/" in url.path:
+            return "dixmax_login"
+        return "dixmax"
+    if url.host == ADDON_HOST:
+        return "self"
+    # Un host arbitrario no puede crear series de métricas nuevas
+    return f"cdn:{url.host}" if url.host in CDN_HOSTS else "cdn:other"
+
+def route_upstream(url: httpx.URL):
+    # (pool, clase): TMDB, dixmax y el ping tienen pool propio; cada CDN conocido, uno por
+    # host, y los demás comparten "cdn:other", así que el número de pools está acotado
+    upstream = classify_upstream(url)
+    if upstream.startswith("dixmax"):
+        return "dixmax", "dixmax"
+    if upstream.startswith("cdn:"):
+        return upstream, "cdn"
+    return upstream, upstream
+
+UPSTREAM_POOLS = {
+    "tmdb": UpstreamPool(UPSTREAM_TMDB_MAX_CONNECTIONS, httpx.Timeout(UPSTREAM_TMDB_TIMEOUT, connect=3.0)),
+    "dixmax": UpstreamPool(UPSTREAM_DIXMAX_MAX_CONNECTIONS, httpx.Timeout(UPSTREAM_DIXMAX_TIMEOUT, connect=5.0)),
+    "cdn": UpstreamPool(UPSTREAM_CDN_MAX_CONNECTIONS, httpx.Timeout(UPSTREAM_CDN_TIMEOUT, connect=5.0)),
+    "self": UpstreamPool(2, httpx.Timeout(10.0, connect=5.0), keepalive_expiry=120),
+}
+upstream_transport = UpstreamTransport(
+    route_upstream, UPSTREAM_POOLS, timeout,
+    http2_hosts=UPSTREAM_HTTP2_HOSTS, dns_ttl=DNS_CACHE_TTL, verify=False,
+)
+
 http_client = httpx.AsyncClient(
     timeout=timeout,
-    limits=limits,
+    transport=InstrumentedTransport(upstream_transport, classify_upstream),
     follow_redirects=True,
-    verify=False,
     headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
 )
 
+# Fallos recientes (título no encontrado, sin enlaces, error del upstream) con TTL corto por tipo
+NEGATIVE_CACHE = NegativeCache(
+    {"not_found": NEGATIVE_TTL_NOT_FOUND, "empty_links": NEGATIVE_TTL_EMPTY_LINKS, "upstream_error": NEGATIVE_TTL_UPSTREAM_ERROR},
+    capacity=NEGATIVE_CACHE_CAPACITY,
+    error_rate=NEGATIVE_CACHE_ERROR_RATE,
+)
+metadata_provider = CachedMetadataProvider(
+    TMDB(http_client), ttl=METADATA_CACHE_TTL, maxsize=METADATA_CACHE_SIZE, negative=NEGATIVE_CACHE
+)
+
 app = FastAPI(root_path=f"/{ROOT_PATH}" if ROOT_PATH and not ROOT_PATH.startswith("/") else ROOT_PATH)
 
 app.add_middleware(
@@ -35,78 +120,320 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware, endpoints=["/stream", "/proxy/filter", "/proxy/playlist", "/proxy/segment", "/manifest.json", "/metrics"])
+
+SHARED_CACHE = CACHE_BACKEND == "sqlite"
 
-CACHE = {}
-LINK_CACHE = {}
-MAX_CACHE_SIZE = 2000
-
-async def ensure_cache_space():
-    if len(CACHE) >= MAX_CACHE_SIZE:
-        items_to_delete = sorted(CACHE.items(), key=lambda x: x[1]['last_access'])[:int(MAX_CACHE_SIZE * 0.1)]
-        for key, _ in items_to_delete:
-            del CACHE[key]
-        logger.info(f"[CACHE CLEANUP] Espacio liberado. Eliminados: {len(items_to_delete)}")
-
-async def get_or_fetch_content(url: str):
-    now = time.time()
-    if url in CACHE:
-        CACHE[url]['last_access'] = now
-        logger.info(f"[CACHE HIT] {url[:60]}...")
-        return CACHE[url]['content'], 200, CACHE[url]['ctype']
-
-    content, status, ctype = await fetch_and_rewrite_manifest(http_client, url)
+# Masters reescritos: url -> MasterPlaylist, acotado en bytes y con TTL por entrada
+CACHE = make_cache(
+    CACHE_BACKEND,
+    CACHE_DB_PATH,
+    "manifests",
+    maxsize=MANIFEST_CACHE_MAX_ENTRIES,
+    ttl=MANIFEST_CACHE_TTL,
+    max_bytes=MANIFEST_CACHE_MAX_BYTES,
+    sizeof=lambda master: master.nbytes,
+    local_ttl=SHARED_CACHE_LOCAL_TTL,
+    encode=lambda master: master.to_blob(),
+    decode=MasterPlaylist.from_blob,
+)
+LINK_CACHE = LinkStore(
+    LINK_CACHE_PATH,
+    maxsize=LINK_CACHE_SIZE,
+    ttl=LINK_CACHE_TTL,
+    flush_interval=LINK_CACHE_FLUSH_INTERVAL,
+    shared=SHARED_CACHE,
+    local_ttl=SHARED_CACHE_LOCAL_TTL if SHARED_CACHE else None,
+)
+manifest_flight = SingleFlight()
+MANIFEST_REVALIDATIONS = REGISTRY.counter(
+    "ndkmax_manifest_revalidations_total", "Revalidaciones en segundo plano de masters por resultado.", ("result",)
+)
+# Media playlists en modo proxy: TTL corto para que las listas en directo avancen. Cada
+# segmento es una URL firmada larga y una VOD ocupa cientos de KB: se acota también en bytes
+MEDIA_CACHE = TTLCache(
+    maxsize=MEDIA_PLAYLIST_CACHE_SIZE,
+    ttl=MEDIA_PLAYLIST_CACHE_TTL,
+    max_bytes=MEDIA_PLAYLIST_CACHE_MAX_BYTES,
+    sizeof=lambda entry: len(entry[0]),
+)
+playlist_flight = SingleFlight()
+PROXY_BASE = str(ADDON_URL).rstrip('/') if PROXY_MODE else None
+# Respuestas de /stream ya serializadas y en gzip: (type, id) -> (body, fresh_until)
+STREAM_CACHE = TTLCache(maxsize=STREAM_CACHE_SIZE, ttl=STREAM_CACHE_TTL)
+# Clave de LINK_CACHE -> clave de STREAM_CACHE, para retirar la respuesta si sus enlaces mueren
+STREAM_KEYS = TTLCache(maxsize=STREAM_CACHE_SIZE, ttl=STREAM_CACHE_TTL)
+stream_flight = SingleFlight()
+_background_tasks = set()
+# Peticiones de /stream de usuarios en curso; la precarga cede el paso mientras haya
+_live_streams = 0
+prefetcher = Prefetcher(PREFETCH_CONCURRENCY, PREFETCH_QUEUE_SIZE, is_busy=lambda: _live_streams > 0)
+# Admisión de los fallos de caché; los aciertos y las esperas a una descarga en curso no pasan por aquí
+ADMISSION = {
+    "stream": AdmissionController(ADMISSION_STREAM_CONCURRENCY, ADMISSION_STREAM_QUEUE, ADMISSION_QUEUE_TIMEOUT),
+    "filter": AdmissionController(ADMISSION_FILTER_CONCURRENCY, ADMISSION_FILTER_QUEUE, ADMISSION_QUEUE_TIMEOUT),
+}
+client_limiter = ClientRateLimiter(CLIENT_RATE, CLIENT_BURST)
+trusted_proxies = TrustedProxies(TRUSTED_PROXIES)
+
+def client_ip(request: Request) -> str:
+    peer = request.client.host if request.client else "unknown"
+    return trusted_proxies.client(peer, ",".join(request.headers.getlist("x-forwarded-for")))
+
+def shed_response(error: Overloaded):
+    status_code = 429 if error.reason == "rate_limited" else 503
+    return Response(status_code=status_code, headers={"Retry-After": str(error.retry_after)})
+
+async def get_or_fetch_content(url: str, admission: AdmissionController = None):
+    master = await CACHE.get(url)
+    if master is not None:
+        logger.info("[CACHE HIT] %s...", url[:60], extra={"sample": "cache_hit"})
+        master.hits += 1
+        # Los populares se revalidan antes de caducar para no pagar nunca un fallo síncrono
+        if (master.hits >= MANIFEST_REFRESH_MIN_HITS and url not in manifest_flight
+                and time.time() - master.fetched_at >= MANIFEST_CACHE_TTL * MANIFEST_REFRESH_AHEAD):
+            spawn(manifest_flight.do(url, lambda: _revalidate(url, master)))
+        return master, 200
+
+    # Los fallos concurrentes de la misma URL esperan una única descarga
+    if url in manifest_flight:
+        logger.info("[CACHE COALESCED] %s... (total: %d)", url[:60], manifest_flight.coalesced + 1, extra={"sample": "cache_coalesced"})
+    elif admission is not None:
+        async with admission.slot():
+            return await manifest_flight.do(url, lambda: _fetch_and_store(url))
+    return await manifest_flight.do(url, lambda: _fetch_and_store(url))
+
+async def _fetch_and_store(url: str):
+    content, status, ctype, validators = await fetch_and_rewrite_manifest(http_client, url, PROXY_BASE)
     
     if status == 200 and content:
-        await ensure_cache_space()
-        CACHE[url] = {
-            'content': content,
-            'ctype': ctype,
-            'last_access': now
-        }
+        master = MasterPlaylist(content, ctype, *validators)
+        CACHE.set(url, master)
+        return master, status
     
-    return content, status, ctype
+    return None, status
+
+async def _revalidate(url: str, master: MasterPlaylist):
+    content, status, ctype, validators = await fetch_and_rewrite_manifest(http_client, url, PROXY_BASE, master.validators)
+
+    if status == 304:
+        # Sin cambios: se renueva el TTL de la copia actual sin descargar ni reescribir
+        master.fetched_at = time.time()
+        master.hits = 0
+        CACHE.set(url, master)
+        MANIFEST_REVALIDATIONS.inc("not_modified")
+        return master, 200
 
-def actualizar_perfiles_periodicamente():
-    state.INSTANCIAS = {} 
-    for nombre, cred in PERFILES.items():
-        p = Perfil(cred)
-        if p.valido:
-            state.INSTANCIAS[nombre] = p
-    if state.INSTANCIAS:
-        state.gestor = GestorPerfiles(state.INSTANCIAS)
-        print(f"[INFO] Perfiles activos: {len(state.INSTANCIAS)}")
+    if status == 200 and content:
+        fresh = MasterPlaylist(content, ctype, *validators)
+        CACHE.set(url, fresh)
+        MANIFEST_REVALIDATIONS.inc("modified")
+        return fresh, 200
+
+    # Un fallo puntual no tira la copia buena: se sigue sirviendo hasta que caduque
+    logger.warning(f"[REVALIDATE] {status} para {url[:60]}..., se mantiene la copia en caché")
+    MANIFEST_REVALIDATIONS.inc("error")
+    return master, 200
+
+async def actualizar_perfiles_periodicamente():
+    # Los perfiles con sesión viva se conservan; los SID caducados se renuevan al usarse
+    activos = {nombre: p for nombre, p in state.INSTANCIAS.items() if p.valido}
+    pendientes = {nombre: cred for nombre, cred in PERFILES.items() if nombre not in activos}
+    if not pendientes:
+        return
+
+    activos.update(await crear_perfiles(http_client, pendientes))
+    if activos:
+        # Se sustituye el gestor de una vez: las peticiones en curso nunca lo ven vacío
+        state.INSTANCIAS, state.gestor = activos, GestorPerfiles(activos)
+        logger.info(f"[PERFILES] Perfiles activos: {len(activos)}")
     else:
         logger.error("PERFILES: Ninguno válido.")
 
 @app.on_event("startup")
 async def startup_event():
-    actualizar_perfiles_periodicamente()
+    await LINK_CACHE.start()
+    await CACHE.start()
+    await prefetcher.start()
+    spawn(monitor_loop_lag())
+    await actualizar_perfiles_periodicamente()
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await prefetcher.close()
+    await LINK_CACHE.close()
+    await CACHE.close()
     await http_client.aclose()
 
+def encoded_response(gz: bytes, accept_encoding: str, media_type: str, headers: dict = None):
+    """Sirve un artefacto guardado en gzip tal cual si el cliente lo admite; si no, descomprimido."""
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+    if accepts_gzip(accept_encoding):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=gz, media_type=media_type, headers=headers)
+    return Response(content=decompress(gz), media_type=media_type, headers=headers)
+
 @app.get("/proxy/filter")
-async def proxy_filter_endpoint(url: str, bw: int):
+async def proxy_filter_endpoint(request: Request, url: str, bw: int, sig: str = None,
+                                if_none_match: str = Header(None), accept_encoding: str = Header(None)):
     if not url: return Response(status_code=400)
-    target_url = unquote(url)
+    # Solo URLs generadas por el addon: si no, sería un proxy abierto hacia cualquier host
+    if not verify_url(url, sig): return Response(status_code=403)
+    trust_cdn_host(url)
     
-    content, status, _ = await get_or_fetch_content(target_url)
+    try:
+        if url not in manifest_flight and not await CACHE.contains(url):
+            client_limiter.check(client_ip(request))
+        master, status = await get_or_fetch_content(url, ADMISSION["filter"])
+    except Overloaded as e:
+        return shed_response(e)
 
-    if status != 200 or not content:
+    if status != 200 or master is None:
         return Response(status_code=status or 404)
         
-    filtered_content = filter_manifest_by_quality(content, bw)
+    nbytes = master.nbytes
+    filtered_gz, etag = master.render(bw)
+    if master.nbytes != nbytes:
+        # Primera vez que se pide esta calidad: la salida memorizada cuenta para MANIFEST_CACHE_MAX_BYTES
+        CACHE.resize(url)
+    if accepts_gzip(accept_encoding):
+        # Cada codificación es una representación distinta y necesita su propio ETag
+        etag = etag[:-1] + '-gzip"'
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Cache-Control": "public, max-age=3600",
+        "ETag": etag,
+    }
+
+    if if_none_match and etag in if_none_match:
+        return Response(status_code=304, headers={**headers, "Vary": "Accept-Encoding"})
     
+    return encoded_response(filtered_gz, accept_encoding, "application/vnd.apple.mpegurl", headers)
+
+async def _fetch_media_playlist(url: str):
+    content, status, ctype, _ = await fetch_and_rewrite_manifest(http_client, url, PROXY_BASE)
+    if status == 200 and content:
+        MEDIA_CACHE.set(url, (content, ctype))
+    return content, status, ctype
+
+@app.get("/proxy/playlist")
+async def proxy_playlist_endpoint(url: str, sig: str = None):
+    if not PROXY_MODE or not url: return Response(status_code=404)
+    if not verify_url(url, sig): return Response(status_code=403)
+    trust_cdn_host(url)
+
+    cached = MEDIA_CACHE.get(url)
+    if cached is not None:
+        content, ctype = cached
+    else:
+        content, status, ctype = await playlist_flight.do(url, lambda: _fetch_media_playlist(url))
+        if status != 200 or not content:
+            return Response(status_code=status or 404)
+
     return Response(
-        content=filtered_content,
-        media_type="application/vnd.apple.mpegurl",
+        content=content,
+        media_type=ctype,
         headers={
             "Access-Control-Allow-Origin": "*",
-            "Cache-Control": "public, max-age=3600"
+            "Cache-Control": f"public, max-age={int(MEDIA_PLAYLIST_CACHE_TTL)}"
         }
     )
 
+@app.get("/proxy/segment")
+async def proxy_segment_endpoint(url: str, sig: str = None, range_header: str = Header(None, alias="Range")):
+    if not PROXY_MODE or not url: return Response(status_code=404)
+    if not verify_url(url, sig): return Response(status_code=403)
+    trust_cdn_host(url)
+
+    try:
+        upstream = await open_segment(http_client, url, range_header)
+    except httpx.RequestError as e:
+        logger.error(f"[SEGMENT] Error abriendo segmento: {e}")
+        return Response(status_code=502)
+
+    if upstream.status_code not in (200, 206):
+        await upstream.aclose()
+        return Response(status_code=upstream.status_code)
+
+    headers = {k: v for k, v in upstream.headers.items() if k.lower() in SEGMENT_HEADERS}
+    headers["Access-Control-Allow-Origin"] = "*"
+
+    async def body():
+        # Se cierra también si el cliente corta a mitad de segmento
+        try:
+            async for chunk in upstream.aiter_raw(SEGMENT_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await upstream.aclose()
+
+    # StreamingResponse solo pide el siguiente trozo cuando el anterior se ha enviado
+    return StreamingResponse(body(), status_code=upstream.status_code, headers=headers)
+
+@REGISTRY.collector
+def collect_caches():
+    caches = {
+        "manifests": CACHE.stats(),
+        "links": LINK_CACHE.stats(),
+        "streams": STREAM_CACHE.stats(),
+        "media_playlists": MEDIA_CACHE.stats(),
+        **{f"tmdb_{name}": stats for name, stats in metadata_provider.stats().items() if isinstance(stats, dict)},
+        "dns": upstream_transport.stats()["dns"],
+        **NEGATIVE_CACHE.stats(),
+    }
+    for field, type in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("expirations", "counter"),
+                        ("remote_hits", "counter"), ("size", "gauge"), ("bytes", "gauge"), ("pending", "gauge")):
+        suffix = "_total" if type == "counter" else ""
+        samples = [((name,), stats[field]) for name, stats in caches.items() if field in stats]
+        yield f"ndkmax_cache_{field}{suffix}", type, f"Caché: {field}.", ("cache",), samples
+
+    flights = {"manifests": manifest_flight, "streams": stream_flight, "media_playlists": playlist_flight}
+    yield ("ndkmax_coalesced_requests_total", "counter", "Peticiones que esperaron a una descarga ya en curso.",
+           ("flight",), [((name,), flight.coalesced) for name, flight in flights.items()])
+    yield ("ndkmax_inflight_fetches", "gauge", "Descargas compartidas en curso.",
+           ("flight",), [((name,), len(flight)) for name, flight in flights.items()])
+    yield ("ndkmax_prefetch_jobs", "gauge", "Trabajos de precarga en cola o en curso.", (), [((), len(prefetcher))])
+    yield ("ndkmax_prefetch_dropped_total", "counter", "Trabajos de precarga descartados por cola llena.", (), [((), prefetcher.dropped)])
+    yield ("ndkmax_upstream_pools", "gauge", "Pools de conexiones abiertos (uno por clase y por host de CDN conocido).",
+           (), [((), upstream_transport.stats()["pools"])])
+    yield ("ndkmax_background_tasks", "gauge", "Tareas en segundo plano vivas.", (), [((), len(_background_tasks))])
+    yield ("ndkmax_log_records_dropped_total", "counter", "Registros de log descartados por cola llena.", (), [((), dropped_records())])
+
+@REGISTRY.collector
+def collect_profiles():
+    perfiles = list(state.INSTANCIAS.items())
+    yield ("ndkmax_profile_usage_total", "counter", "Veces que GestorPerfiles ha elegido cada perfil.",
+           ("profile",), [((name,), p.usage_counter) for name, p in perfiles])
+    yield ("ndkmax_profile_errors_total", "counter", "Respuestas fallidas de hash_link_v5 por perfil.",
+           ("profile",), [((name,), p.error_counter) for name, p in perfiles])
+    yield ("ndkmax_profile_valid", "gauge", "1 si el perfil tiene sesión válida.",
+           ("profile",), [((name,), int(p.valido)) for name, p in perfiles])
+    yield ("ndkmax_profile_in_flight", "gauge", "Llamadas a hash_link_v5 en curso por perfil.",
+           ("profile",), [((name,), p.en_curso) for name, p in perfiles])
+    yield ("ndkmax_profile_latency_seconds", "gauge", "Media móvil de la latencia de hash_link_v5 por perfil.",
+           ("profile",), [((name,), p.latencia) for name, p in perfiles])
+    yield ("ndkmax_profile_error_rate", "gauge", "Media móvil de la tasa de error por perfil.",
+           ("profile",), [((name,), p.tasa_error) for name, p in perfiles])
+    ahora = time.monotonic()
+    yield ("ndkmax_profile_circuit_open", "gauge", "1 si el perfil está fuera de servicio por fallos seguidos.",
+           ("profile",), [((name,), int(p.cortocircuito_abierto(ahora))) for name, p in perfiles])
+    yield ("ndkmax_profile_waiting", "gauge", "Peticiones esperando a un perfil libre.",
+           (), [((), state.gestor.esperando if state.gestor is not None else 0)])
+
+@REGISTRY.collector
+def collect_admission():
+    yield ("ndkmax_admission_in_flight", "gauge", "Fallos de caché admitidos en curso por endpoint.",
+           ("endpoint",), [((name,), c.in_flight) for name, c in ADMISSION.items()])
+    yield ("ndkmax_admission_queue_depth", "gauge", "Peticiones esperando admisión por endpoint.",
+           ("endpoint",), [((name,), c.waiting) for name, c in ADMISSION.items()])
+    samples = [((name, reason), count) for name, c in ADMISSION.items() for reason, count in c.shed.items()]
+    samples.append((("any", "rate_limited"), client_limiter.limited))
+    yield ("ndkmax_admission_shed_total", "counter", "Peticiones rechazadas sin ir al upstream.",
+           ("endpoint", "reason"), samples)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/manifest.json")
 async def get_manifest():
     return {
@@ -119,90 +446,235 @@ async def get_manifest():
         "behaviorHints": {"configurable": False},
     }
 
-@app.get("/stream/{stream_type}/{stream_id}")
-async def get_results(stream_type: str, stream_id: str):
+def link_cache_key(media_id, is_movie: bool, season=0, episode=0) -> str:
+    return f"{media_id}_{is_movie}_{season}_{episode}"
+
+async def resolve_links(media_id, is_movie: bool, season=0, episode=0):
+    cache_key = link_cache_key(media_id, is_movie, season, episode)
+
+    cached = await LINK_CACHE.get(cache_key)
+    if cached is not None:
+        logger.info("[LINK CACHE HIT] Recuperando enlace para %s", cache_key, extra={"sample": "link_cache_hit"})
+        return cached
+
+    # Títulos sin enlaces o con los que dixmax acaba de fallar: no se gasta cuota de perfiles
+    if NEGATIVE_CACHE.get(cache_key):
+        return []
+
     try:
-        stream_id_clean = stream_id.replace(".json", "")
-        metadata_provider = TMDB(http_client)
-        media = await metadata_provider.get_metadata(stream_id_clean, stream_type)
+        search_results = await obtener_enlace(http_client, media_id, is_movie=is_movie, season=season, episode=episode)
+    except SinPerfiles as e:
+        # Saturación local (todos los perfiles ocupados o caídos): no dice nada del título, no se recuerda
+        logger.warning(f"[LINKS] Sin perfil para {cache_key}: {e}")
+        return []
+    except httpx.RequestError as e:
+        # Timeouts y errores de red de dixmax cuentan como un fallo suyo
+        logger.warning(f"[LINKS] Error buscando enlaces para {cache_key}: {e}")
+        search_results = None
+    if search_results:
+        LINK_CACHE.set(cache_key, search_results)
+    else:
+        NEGATIVE_CACHE.add("empty_links" if search_results is not None else "upstream_error", cache_key)
+    return search_results or []
+
+def spawn(coro):
+    # Tareas que deben sobrevivir al plazo de la petición (siguen llenando las cachés)
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
-        if not media: return {"streams": []}
+async def build_streams(stream_type: str, stream_id: str):
+    """Devuelve (streams, completo); completo es False si algo se quedó fuera por el plazo."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_DEADLINE
+
+    try:
+        media = await asyncio.wait_for(metadata_provider.get_metadata(stream_id, stream_type), STREAM_DEADLINE)
+
+        if not media: return [], True
 
         is_movie = (media.type == "movie")
         season = getattr(media, 'season', 0)
         episode = getattr(media, 'episode', 0)
-        
-        cache_key = f"{media.id}_{is_movie}_{season}_{episode}"
+        STREAM_KEYS.set(link_cache_key(media.id, is_movie, season, episode), (stream_type, stream_id))
 
         if is_movie:
             titulo = media.titles[0]
-            duracion = await metadata_provider.get_duration(media.id, media.type)
+            duration_task = spawn(metadata_provider.get_duration(media.id, media.type))
         else:
             titulo = f"{media.titles[0]} S{media.season}E{media.episode}"
-            duracion = await metadata_provider.get_duration(media.id, media.type, media.season, media.episode)
+            duration_task = spawn(metadata_provider.get_duration(media.id, media.type, media.season, media.episode))
 
-        if cache_key in LINK_CACHE:
-            logger.info(f"[LINK CACHE HIT] Recuperando enlace para {cache_key}")
-            search_results = LINK_CACHE[cache_key]
-        else:
-            search_results = await obtener_enlace(http_client, media.id, is_movie=is_movie, season=season, episode=episode)
-            if search_results:
-                LINK_CACHE[cache_key] = search_results
+        # Duración y enlaces son independientes: se resuelven en paralelo
+        links_task = spawn(resolve_links(media.id, is_movie, season, episode))
+        search_results = await asyncio.wait_for(asyncio.shield(links_task), max(deadline - loop.time(), 0))
+
+        if not search_results: return [], True
+        for result_url in search_results:
+            trust_cdn_host(result_url)
 
-        if not search_results: return {"streams": []}
+        fetch_tasks = [spawn(get_or_fetch_content(result_url)) for result_url in search_results]
+        done, pending = await asyncio.wait([duration_task, *fetch_tasks], timeout=max(deadline - loop.time(), 0))
+
+        if duration_task in done:
+            duracion = duration_task.result()
+        else:
+            logger.warning(f"[DEADLINE] Duración no disponible para {stream_id}")
+            duracion = 0
 
         final_streams = []
 
-        for result_url in search_results:
-            content, status, _ = await get_or_fetch_content(result_url)
-            
-            if status == 200 and content:
-                streams = parse_manifest_to_qualities(result_url, titulo, duracion, content)
+        for result_url, task in zip(search_results, fetch_tasks):
+            if task not in done:
+                logger.warning(f"[DEADLINE] Master descartado: {result_url[:60]}...")
+                continue
+
+            master, status = task.result()
+            if status == 200 and master is not None:
+                streams = parse_manifest_to_qualities(result_url, titulo, duracion, parsed=master.parsed)
                 final_streams.extend(streams)
 
-        return {"streams": final_streams}
+        return final_streams, not pending
+    except asyncio.TimeoutError:
+        logger.warning(f"[DEADLINE] Sin enlaces a tiempo para {stream_id}")
+        return [], False
     except Exception as e:
         logger.error(f"Error en streams: {e}")
-        return {"streams": []}
+        return [], False
+
+async def refresh_streams(stream_type: str, stream_id: str):
+    streams, complete = await build_streams(stream_type, stream_id)
+    body = compress(json.dumps({"streams": streams}, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    # Solo se guardan respuestas completas: una parcial no debe tapar a la anterior
+    if complete and streams:
+        STREAM_CACHE.set((stream_type, stream_id), (body, time.monotonic() + STREAM_CACHE_FRESH))
+    elif complete:
+        # Ya no hay streams (p. ej. enlaces muertos): no se sigue sirviendo la respuesta antigua
+        STREAM_CACHE.pop((stream_type, stream_id))
+    return body
+
+async def warm_streams(stream_type: str, stream_id: str):
+    key = (stream_type, stream_id)
+    cached = STREAM_CACHE.get(key)
+    if cached is not None and time.monotonic() < cached[1]:
+        return
+    await stream_flight.do(key, lambda: refresh_streams(stream_type, stream_id))
+
+async def prefetch_episode(imdb_id: str, season: int, episode: int):
+    # Pasado el final de temporada no hay nada que buscar: se consulta antes el índice de TMDB
+    media = await metadata_provider.get_metadata(f"{imdb_id}:{season}:{episode}", "series")
+    season_index = await metadata_provider.get_season(media.id, season) if media else None
+    if not season_index or episode not in season_index:
+        return
+    await warm_streams("series", f"{imdb_id}:{season}:{episode}")
+
+def prefetch_next_episodes(stream_id: str):
+    # "tt123:1:3" -> precarga S1E4, S1E5... para que el autoplay encuentre la caché caliente
+    parts = stream_id.split(":")
+    if len(parts) != 3:
+        return
+    try:
+        imdb_id, season, episode = parts[0], int(parts[1]), int(parts[2])
+    except ValueError:
+        return
+    for n in range(1, PREFETCH_EPISODES + 1):
+        next_id = f"{imdb_id}:{season}:{episode + n}"
+        prefetcher.submit(("series", next_id), lambda n=n: prefetch_episode(imdb_id, season, episode + n))
+
+@app.get("/stream/{stream_type}/{stream_id}")
+async def get_results(request: Request, stream_type: str, stream_id: str, accept_encoding: str = Header(None)):
+    global _live_streams
+    stream_id_clean = stream_id.replace(".json", "")
+    key = (stream_type, stream_id_clean)
+
+    if stream_type == "series":
+        prefetch_next_episodes(stream_id_clean)
+
+    cached = STREAM_CACHE.get(key)
+    if cached is not None:
+        body, fresh_until = cached
+        # Caducada: se sirve igualmente y se refresca en segundo plano
+        if time.monotonic() >= fresh_until and key not in stream_flight:
+            spawn(stream_flight.do(key, lambda: refresh_streams(stream_type, stream_id_clean)))
+        return encoded_response(body, accept_encoding, "application/json")
+
+    refresh = lambda: refresh_streams(stream_type, stream_id_clean)
+    _live_streams += 1
+    try:
+        if key in stream_flight:
+            body = await stream_flight.do(key, refresh)
+        else:
+            client_limiter.check(client_ip(request))
+            async with ADMISSION["stream"].slot():
+                body = await stream_flight.do(key, refresh)
+    except Overloaded as e:
+        return shed_response(e)
+    finally:
+        _live_streams -= 1
+    return encoded_response(body, accept_encoding, "application/json")
 
 @crontab("0 */4 * * *", start=not IS_DEV)
 async def actualizar_perfiles():
-    actualizar_perfiles_periodicamente()
+    await actualizar_perfiles_periodicamente()
 
-@crontab("0 3 * * *", start=True)
-async def validar_enlaces_diario():
-    logger.info("[VALIDATOR] Iniciando comprobación diaria de enlaces...")
-    keys_to_remove = []
-    
-    for key, urls in list(LINK_CACHE.items()):
-        all_dead = True
-        for url in urls:
-            try:
-                resp = await http_client.head(url, timeout=5.0)
-                if resp.status_code == 200:
-                    all_dead = False
-                    break
-            except Exception:
-                continue
-        
-        if all_dead:
-            keys_to_remove.append(key)
-
-    for key in keys_to_remove:
-        dead_urls = LINK_CACHE.pop(key, [])
-        for url in dead_urls:
-            if url in CACHE:
-                del CACHE[url]
-                
-    if keys_to_remove:
-        logger.info(f"[VALIDATOR] Eliminadas {len(keys_to_remove)} entradas caducadas.")
-    else:
-        logger.info("[VALIDATOR] Todos los enlaces en caché siguen activos.")
+def _evict_dead_link(key, urls):
+    for url in urls:
+        CACHE.pop(url)
+    # La respuesta de /stream que los incluía también: la próxima petición busca enlaces nuevos
+    stream_key = STREAM_KEYS.pop(key)
+    if stream_key is not None:
+        STREAM_CACHE.pop(stream_key)
+
+link_validator = LinkValidator(
+    http_client,
+    LINK_CACHE,
+    concurrency=LINK_VALIDATOR_CONCURRENCY,
+    per_host_rate=LINK_VALIDATOR_HOST_RATE,
+    batch_size=LINK_VALIDATOR_BATCH,
+    on_dead=_evict_dead_link,
+)
+
+@crontab("* * * * *", start=True)
+async def validar_enlaces():
+    # Un lote pequeño por minuto, empezando por lo validado hace más tiempo.
+    # Con varios workers solo valida el que tiene el lock del fichero de enlaces.
+    if acquire_leader_lock(LINK_CACHE_PATH):
+        await link_validator.run_batch()
+
+async def warm_title(stream_type: str, stream_id: str) -> bool:
+    # Mismo camino que /stream: TMDB, obtener_enlace y get_or_fetch_content, dejando todo en caché
+    await warm_streams(stream_type, stream_id)
+    return STREAM_CACHE.get((stream_type, stream_id)) is not None
+
+def _read_lines(path: str):
+    with open(path) as f:
+        return f.readlines()
+
+def _write_report(path: str, report: dict):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+async def warm_catalog(targets_path: str = WARM_TARGETS_PATH, concurrency: int = WARM_CONCURRENCY):
+    """Precalienta las cachés con los títulos de ``targets_path`` y escribe el informe en WARM_REPORT_PATH."""
+    targets = parse_targets(await asyncio.to_thread(_read_lines, targets_path))
+    keys = await expand_targets(targets, metadata_provider)
+    warmer = CacheWarmer(warm_title, concurrency, WARM_STATE_PATH, is_busy=lambda: _live_streams > 0)
+    report = await warmer.run(keys)
+    await asyncio.to_thread(_write_report, WARM_REPORT_PATH, report)
+    return report
+
+@crontab(WARM_CRON, start=not IS_DEV and bool(WARM_TARGETS_PATH))
+async def calentar_cache():
+    # Como la validación, solo en el worker que tiene el lock
+    if acquire_leader_lock(LINK_CACHE_PATH):
+        await warm_catalog()
 
 @crontab("* * * * *", start=not IS_DEV)
 async def ping_service():
     try:
-        async with httpx.AsyncClient() as client:
-            await client.get(ADDON_URL)
+        # Reutiliza la conexión del pool "self" en vez de abrir un cliente nuevo cada minuto
+        await http_client.get(ADDON_URL)
     except httpx.RequestError as e:
         logger.error(f"Fallo en el ping al servicio: {e}")
@@ -0,0 +1,92 @@
+import copy
+
+from metadata.metadata_provider_base import MetadataProvider, MetadataError
+from utils.cache import TTLCache, SingleFlight
+
+
+class CachedMetadataProvider(MetadataProvider):
+    """Envuelve otro MetadataProvider y cachea sus respuestas en memoria.
+
+    Los metadatos se guardan por id de IMDB (sin temporada/episodio), las
+    temporadas por (tmdb_id, temporada) y el resto de duraciones por
+    (tmdb_id, tipo, temporada, episodio). La duración de un episodio sale del
+    índice de su temporada, así que ver una temporada entera cuesta una sola
+    llamada. Las peticiones concurrentes para la misma clave comparten una
+    única llamada al proveedor.
+
+    Con ``negative`` (un NegativeCache) también se recuerdan durante un rato
+    los ids que TMDB no encuentra (``not_found``) o con los que falla
+    (``upstream_error``), y se responde None sin volver a preguntar.
+    """
+
+    def __init__(self, provider: MetadataProvider, ttl: float, maxsize: int, negative=None):
+        super().__init__()
+        self.provider = provider
+        self.negative = negative
+        self.metadata_cache = TTLCache(maxsize, ttl)
+        self.duration_cache = TTLCache(maxsize, ttl)
+        self.season_cache = TTLCache(maxsize, ttl)
+        self._flight = SingleFlight()
+
+    async def get_metadata(self, id, type):
+        full_id = id.split(":")
+        key = ("metadata", full_id[0], type)
+
+        media = self.metadata_cache.get(key)
+        if media is None:
+            negative_key = f"{type}:{full_id[0]}"
+            if self.negative is not None and self.negative.get(negative_key):
+                return None
+            try:
+                media = await self._flight.do(key, lambda: self.provider.get_metadata(id, type))
+            except MetadataError:
+                if self.negative is not None:
+                    self.negative.add("upstream_error", negative_key)
+                return None
+            if media is None:
+                if self.negative is not None:
+                    self.negative.add("not_found", negative_key)
+                return None
+            self.metadata_cache.set(key, media)
+
+        if type == "series":
+            # La misma serie sirve para todos los episodios: solo cambian season/episode
+            media = copy.copy(media)
+            media.season = int(full_id[1])
+            media.episode = int(full_id[2])
+        return media
+
+    async def get_duration(self, tmdb_id, media_type='movie', season=None, episode=None):
+        if media_type != 'movie' and season and episode:
+            return self.episode_runtime(await self.get_season(tmdb_id, season), episode)
+
+        key = ("duration", tmdb_id, media_type, season, episode)
+
+        duration = self.duration_cache.get(key)
+        if duration is None:
+            duration = await self._flight.do(
+                key, lambda: self.provider.get_duration(tmdb_id, media_type, season, episode)
+            )
+            # 0 es también el valor de error de TMDB, así que no se cachea
+            if duration:
+                self.duration_cache.set(key, duration)
+        return duration
+
+    async def get_season(self, tmdb_id, season):
+        key = ("season", tmdb_id, int(season))
+
+        season_index = self.season_cache.get(key)
+        if season_index is None:
+            season_index = await self._flight.do(key, lambda: self.provider.get_season(tmdb_id, season))
+            # Un error (None) o una temporada aún sin episodios no se cachean
+            if season_index:
+                self.season_cache.set(key, season_index)
+        return season_index
+
+    def stats(self) -> dict:
+        return {
+            "metadata": self.metadata_cache.stats(),
+            "duration": self.duration_cache.stats(),
+            "season": self.season_cache.stats(),
+            "coalesced": self._flight.coalesced,
+        }
@@ -3,6 +3,10 @@ import unicodedata
 from utils.logger import setup_logger
 
 
+class MetadataError(Exception):
+    """El proveedor no ha podido responder (red o estado HTTP), a diferencia de un título que no existe."""
+
+
 class MetadataProvider:
 
     def __init__(self):
@@ -12,8 +16,17 @@ class MetadataProvider:
         return ''.join(c for c in unicodedata.normalize('NFD', string)
                        if unicodedata.category(c) != 'Mn')
 
-    def get_metadata(self, id, type):
+    async def get_metadata(self, id, type):
         raise NotImplementedError
     
-    async def get_duration_from_tmdb(self, tmdb_id, media_type='movie', season=None, episode=None):
+    async def get_duration(self, tmdb_id, media_type='movie', season=None, episode=None):
         raise NotImplementedError
+
+    async def get_season(self, tmdb_id, season):
+        """Índice de una temporada: {número de episodio: {"runtime": minutos, "name": título}}."""
+        raise NotImplementedError
+
+    @staticmethod
+    def episode_runtime(season_index, episode) -> int:
+        episode_info = (season_index or {}).get(int(episode))
+        return episode_info["runtime"] if episode_info else 0
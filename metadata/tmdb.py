@@ -1,5 +1,5 @@
 import httpx # OPTIMIZADO
-from metadata.metadata_provider_base import MetadataProvider
+from metadata.metadata_provider_base import MetadataProvider, MetadataError
 from models.movie import Movie
 from models.series import Series
 
@@ -11,10 +11,10 @@ class TMDB(MetadataProvider):
         self.http_client = http_client
 
     async def get_metadata(self, id, type):
-        self.logger.info("Getting metadata for " + type + " with id " + id)
+        self.logger.debug("Getting metadata for %s with id %s", type, id)
 
         full_id = id.split(":")
-        self.logger.debug("Full id: " + str(full_id))
+        self.logger.debug("Full id: %s", full_id)
         
         url = f"https://api.themoviedb.org/3/find/{full_id[0]}?api_key={TMDB_KEY}&external_source=imdb_id&language=es-ES"
         
@@ -24,10 +24,10 @@ class TMDB(MetadataProvider):
             data = response.json()
         except httpx.RequestError as e:
             self.logger.error(f"Error requesting TMDB metadata: {e}")
-            return None # O lanzar una excepción
+            raise MetadataError(str(e))
         except httpx.HTTPStatusError as e:
             self.logger.error(f"TMDB request failed with status {e.response.status_code}")
-            return None # O lanzar una excepción
+            raise MetadataError(f"HTTP {e.response.status_code}")
 
         result = None
         if type == "movie" and data.get("movie_results"):
@@ -47,7 +47,7 @@ class TMDB(MetadataProvider):
             )
         
         if result:
-            self.logger.info("Got metadata for " + type + " with id " + id)
+            self.logger.debug("Got metadata for %s with id %s", type, id)
         else:
             self.logger.warning("Could not find metadata for " + type + " with id " + id)
 
@@ -64,10 +64,8 @@ class TMDB(MetadataProvider):
 
             else:
                 if season and episode:
-                    url = f"https://api.themoviedb.org/3/tv/{tmdb_id}/season/{season}/episode/{episode}?api_key={TMDB_KEY}&language=es-ES"
-                    resp = await self.http_client.get(url)
-                    data = resp.json()
-                    return data.get('runtime', 0)
+                    # La temporada entera trae todos los episodios: una llamada sirve para toda la temporada
+                    return self.episode_runtime(await self.get_season(tmdb_id, season), episode)
                 else:
                     url = f"https://api.themoviedb.org/3/tv/{tmdb_id}?api_key={TMDB_KEY}&language=es-ES"
                     resp = await self.http_client.get(url)
@@ -79,3 +77,18 @@ class TMDB(MetadataProvider):
             self.logger.error(f"Error obteniendo duración TMDB: {e}")
             return 0
 
+    async def get_season(self, tmdb_id, season):
+        url = f"https://api.themoviedb.org/3/tv/{tmdb_id}/season/{season}?api_key={TMDB_KEY}&language=es-ES"
+        try:
+            resp = await self.http_client.get(url)
+            resp.raise_for_status()
+            data = resp.json()
+        except (httpx.RequestError, httpx.HTTPStatusError, ValueError) as e:
+            self.logger.error(f"Error obteniendo temporada {season} de {tmdb_id} en TMDB: {e}")
+            return None
+
+        return {
+            episode["episode_number"]: {"runtime": episode.get("runtime") or 0, "name": episode.get("name")}
+            for episode in data.get("episodes", [])
+            if "episode_number" in episode
+        }
@@ -0,0 +1,126 @@
+import math
+import time
+import asyncio
+import ipaddress
+from contextlib import asynccontextmanager
+
+from utils.cache import TTLCache
+
+
+class Overloaded(Exception):
+    """La petición se rechaza sin llegar al upstream; ``retry_after`` en segundos."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Limita las peticiones simultáneas que van al upstream desde un endpoint.
+
+    Hasta ``max_concurrency`` pasan directamente; las siguientes esperan en
+    una cola de como mucho ``max_queue`` y ``queue_timeout`` segundos. Con la
+    cola llena, o agotada la espera, se lanza ``Overloaded`` en el acto en
+    vez de acumular peticiones hasta el timeout de httpx.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = {"queue_full": 0, "timeout": 0}
+
+    def _reject(self, reason: str):
+        self.shed[reason] += 1
+        return Overloaded(reason, max(1, math.ceil(self.queue_timeout)))
+
+    async def _acquire(self):
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return
+        if self.waiting >= self.max_queue:
+            raise self._reject("queue_full")
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise self._reject("timeout")
+        finally:
+            self.waiting -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        await self._acquire()
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+class ClientRateLimiter:
+    """Cubo de tokens por cliente: ``rate`` peticiones/s con ráfagas de hasta ``burst``.
+
+    Los cubos viven en un TTLCache acotado, así que los clientes inactivos no
+    ocupan memoria; uno que vuelve empieza con el cubo lleno.
+    """
+
+    def __init__(self, rate: float, burst: int, maxsize: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = TTLCache(maxsize, ttl=burst / rate if rate > 0 else 60)
+
+        self.limited = 0
+
+    def check(self, client: str):
+        """Consume un token de ``client`` o lanza ``Overloaded`` con el tiempo hasta el siguiente."""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+        if tokens < 1:
+            self.limited += 1
+            raise Overloaded("rate_limited", max(1, math.ceil((1 - tokens) / self.rate)))
+        self._buckets.set(client, (tokens - 1, now))
+
+
+class TrustedProxies:
+    """Averigua la IP del cliente sin fiarse de cabeceras que él mismo puede escribir.
+
+    ``X-Forwarded-For`` solo se tiene en cuenta si la conexión viene de uno
+    de los proxies de ``proxies`` (IPs o redes). En ese caso se recorre de
+    derecha a izquierda y se toma el primer salto que no es de confianza:
+    lo añadió nuestro proxy, mientras que lo que hay a su izquierda lo puede
+    inventar el cliente.
+    """
+
+    def __init__(self, proxies=()):
+        self.networks = [ipaddress.ip_network(proxy, strict=False) for proxy in proxies]
+
+    def __contains__(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.networks)
+
+    def client(self, peer: str, forwarded: str = None) -> str:
+        if not forwarded or peer not in self:
+            return peer
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if hop not in self:
+                return hop
+        # Toda la cadena es de confianza: el origen es el primer salto
+        return hops[0] if hops else peer
@@ -0,0 +1,139 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Caché LRU con caducidad por TTL, acotada por entradas y opcionalmente por bytes.
+
+    Todas las operaciones son O(1): el OrderedDict mantiene el orden de uso
+    y las entradas menos recientes se expulsan al superar ``maxsize`` o
+    ``max_bytes``. El tamaño de cada valor lo calcula ``sizeof``.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, max_bytes: int = None, sizeof=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.bytes = 0
+        self._data = OrderedDict()  # key -> (value, expires_at, size)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[1] > time.monotonic()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        if entry[1] <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        size = self.sizeof(value)
+
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (value, expires_at, size)
+        self.bytes += size
+        self._evict()
+
+    def resize(self, key):
+        """Vuelve a medir un valor que ha crecido en el sitio y expulsa lo que sobre."""
+        entry = self._data.get(key)
+        if entry is None:
+            return
+        size = self.sizeof(entry[0])
+        self._data[key] = (entry[0], entry[1], size)
+        self.bytes += size - entry[2]
+        self._evict()
+
+    def _evict(self):
+        while self._data and (
+            len(self._data) > self.maxsize
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._remove(key)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+        return entry
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SingleFlight:
+    """Agrupa llamadas concurrentes con la misma clave en una sola ejecución.
+
+    La primera llamada lanza la corrutina como tarea; las demás esperan esa
+    misma tarea. El resultado o la excepción llega a todos los que esperan.
+    Si uno de ellos se cancela, la tarea compartida sigue adelante para el resto.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def __contains__(self, key):
+        return key in self._inflight
+
+    async def do(self, key, factory):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Evita el aviso "exception was never retrieved" si nadie quedó esperando
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import fcntl
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.cache import TTLCache
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class MemoryCache(TTLCache):
+    """Backend en memoria del proceso: un TTLCache con la interfaz asíncrona de los backends."""
+
+    async def get(self, key, default=None):
+        return TTLCache.get(self, key, default)
+
+    async def contains(self, key) -> bool:
+        return key in self
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class SQLiteCache:
+    """Caché con TTL persistida en una tabla SQLite (WAL) que pueden compartir varios procesos.
+
+    Delante del fichero hay un TTLCache local (L1) con los valores ya
+    decodificados. Las escrituras y borrados se acumulan en ``_pending`` y se
+    vuelcan por lotes en un hilo aparte, así que nunca bloquean el bucle.
+
+    Con ``shared=True`` un fallo en L1 consulta la tabla (lectura por clave
+    primaria), de modo que lo que descarga un worker lo aprovechan los demás;
+    ``local_ttl`` acota cuánto tarda un borrado en verse en otros procesos.
+    Esas lecturas, y la decodificación del valor, se hacen en un hilo lector
+    propio con su conexión, así que ``get`` es asíncrono y nunca espera al
+    fichero dentro del bucle.
+    Sin ``shared`` la L1 es la copia de referencia y el fichero solo sirve
+    para sobrevivir a reinicios.
+    """
+
+    def __init__(self, path: str, table: str, maxsize: int, ttl: float, flush_interval: float = 5.0,
+                 shared: bool = False, local_ttl: float = None, local_maxsize: int = None,
+                 max_bytes: int = None, sizeof=None, encode=json.dumps, decode=json.loads):
+        self.path = path
+        self.table = table
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self.local_ttl = ttl if local_ttl is None else min(ttl, local_ttl)
+        self.encode = encode
+        self.decode = decode
+        self._local = TTLCache(local_maxsize or maxsize, self.local_ttl, max_bytes=max_bytes, sizeof=sizeof)
+        self._pending = {}  # key -> (valor, expires_at) o None si hay que borrarla
+        self._flush_task = None
+        self._conn = None  # solo se usa desde el hilo lector
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite-{table}")
+
+        self.remote_hits = 0
+
+    def __len__(self):
+        return len(self._local)
+
+    async def get(self, key, default=None):
+        value = self._local.get(key)
+        if value is not None:
+            return value
+        if not self.shared or key in self._pending:
+            return default
+
+        loop = asyncio.get_running_loop()
+        row = await loop.run_in_executor(self._reader, self._read, key)
+        if row is None:
+            return default
+
+        value, expires_at = row
+        self._local.set(key, value, min(expires_at - time.time(), self.local_ttl))
+        self.remote_hits += 1
+        return value
+
+    async def contains(self, key) -> bool:
+        """Como ``get``: cuenta también lo que otro worker haya dejado en la tabla."""
+        return await self.get(key) is not None
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        self._local.set(key, value, min(ttl, self.local_ttl))
+        self._pending[key] = (value, time.time() + ttl)
+
+    def resize(self, key):
+        self._local.resize(key)
+
+    def pop(self, key, default=None):
+        self._pending[key] = None
+        return self._local.pop(key, default)
+
+    def stats(self) -> dict:
+        return {**self._local.stats(), "remote_hits": self.remote_hits, "pending": len(self._pending)}
+
+    async def start(self, warm: bool = True):
+        if warm:
+            loaded = await asyncio.to_thread(self._load)
+            now = time.time()
+            for key, value, expires_at in loaded:
+                self._local.set(key, value, min(expires_at - now, self.local_ttl))
+            logger.info(f"[{self.table.upper()}] Cargadas {len(self._local)} entradas desde {self.path}")
+        self._flush_task = asyncio.ensure_future(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(self._reader, self._close_reader)
+        self._reader.shutdown(wait=False)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except Exception as e:
+            logger.error(f"[{self.table.upper()}] Error guardando {len(batch)} entradas: {e}")
+            # Se reintentan en el siguiente volcado sin pisar cambios más nuevos
+            self._pending = {**batch, **self._pending}
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_expires ON {self.table} (expires_at)")
+        return conn
+
+    def _read(self, key):
+        if self._conn is None:
+            self._conn = self._connect()
+        row = self._conn.execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        return None if row is None else (self.decode(row[0]), row[1])
+
+    def _close_reader(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _load(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT key, value, expires_at FROM {self.table} WHERE expires_at > ? "
+                "ORDER BY expires_at DESC LIMIT ?",
+                (time.time(), self._local.maxsize),
+            ).fetchall()
+        finally:
+            conn.close()
+        # Se insertan de más antigua a más nueva para que el orden LRU sea coherente
+        return [(key, self.decode(value), expires_at) for key, value, expires_at in reversed(rows)]
+
+    def _write(self, batch: dict):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                    [(key, self.encode(entry[0]), entry[1]) for key, entry in batch.items() if entry is not None],
+                )
+                conn.executemany(
+                    f"DELETE FROM {self.table} WHERE key = ?",
+                    [(key,) for key, entry in batch.items() if entry is None],
+                )
+                conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+                conn.execute(
+                    f"DELETE FROM {self.table} WHERE key NOT IN "
+                    f"(SELECT key FROM {self.table} ORDER BY expires_at DESC LIMIT ?)",
+                    (self.maxsize,),
+                )
+        finally:
+            conn.close()
+
+
+def make_cache(backend: str, path: str, table: str, maxsize: int, ttl: float, **kwargs):
+    """Crea la caché según ``backend``: ``memory`` (un proceso) o ``sqlite`` (compartida)."""
+    if backend == "sqlite":
+        return SQLiteCache(path, table, maxsize, ttl, shared=True, **kwargs)
+    if backend != "memory":
+        raise ValueError(f"CACHE_BACKEND desconocido: {backend}")
+    return MemoryCache(maxsize, ttl, max_bytes=kwargs.get("max_bytes"), sizeof=kwargs.get("sizeof"))
+
+
+_leader_lock = None
+
+def acquire_leader_lock(path: str) -> bool:
+    """Intenta ser el único proceso que ejecuta las tareas periódicas ligadas a ``path``."""
+    global _leader_lock
+    if _leader_lock is not None:
+        return True
+    fd = os.open(f"{path}.lock", os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _leader_lock = fd
+    return True
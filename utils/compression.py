@@ -0,0 +1,30 @@
+import gzip
+
+from config import COMPRESSION_LEVEL
+
+
+def compress(data: bytes) -> bytes:
+    # mtime=0: la misma entrada produce siempre los mismos bytes
+    return gzip.compress(data, compresslevel=COMPRESSION_LEVEL, mtime=0)
+
+
+def decompress(data: bytes) -> bytes:
+    return gzip.decompress(data)
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Indica si la cabecera Accept-Encoding admite gzip (directamente o con ``*``) con q > 0."""
+    if not accept_encoding:
+        return False
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        name, _, value = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value) > 0
+            except ValueError:
+                return False
+        return True
+    return False
@@ -1,7 +1,23 @@
+import time
 import httpx
+import asyncio
+from contextlib import asynccontextmanager
 
 import state
 from config import URL_BASE, APP_KEY, AUTH_STR
+from config import PROFILE_MAX_CONCURRENCY, PROFILE_QUEUE_TIMEOUT, PROFILE_BREAKER_FAILURES, PROFILE_BREAKER_COOLDOWN
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Respuestas de hash_link_v5 que indican que el SID del perfil ya no vale
+SESION_CADUCADA = (401, 403)
+
+# Peso de la última muestra en las medias móviles de latencia y errores
+_ALFA = 0.2
+
+class SinPerfiles(RuntimeError):
+    """No hay perfil con el que llamar a dixmax: es un problema local, no del título pedido."""
 
 class Perfil:
     def __init__(self, credenciales: str):
@@ -9,57 +25,176 @@ class Perfil:
         self.username, self.password = credenciales.split(":")
         self.sid = None
         self.valido = False
-
-        self._login()
+        self._lock = asyncio.Lock()
 
         self.usage_counter = 0 
+        self.error_counter = 0
+
+        # Salud: medias móviles, llamadas en curso y cortocircuito
+        self.en_curso = 0
+        self.latencia = 0.0
+        self.tasa_error = 0.0
+        self.fallos_seguidos = 0
+        self.abierto_hasta = 0.0
+
+    def cortocircuito_abierto(self, ahora: float) -> bool:
+        return self.fallos_seguidos >= PROFILE_BREAKER_FAILURES and ahora < self.abierto_hasta
+
+    def disponible(self, ahora: float) -> bool:
+        """Sesión válida y cortocircuito cerrado; pasada la espera se deja una llamada de prueba."""
+        if not self.valido or self.cortocircuito_abierto(ahora):
+            return False
+        return self.fallos_seguidos < PROFILE_BREAKER_FAILURES or self.en_curso == 0
+
+    def puntuacion(self) -> float:
+        # Menor es mejor: latencia esperada escalada por la carga y penalizada por los errores
+        return (self.latencia + 0.05) * (self.en_curso + 1) * (1 + 4 * self.tasa_error)
+
+    def registrar(self, latencia: float, ok: bool):
+        self.latencia += _ALFA * (latencia - self.latencia)
+        self.tasa_error += _ALFA * ((0.0 if ok else 1.0) - self.tasa_error)
+        if ok:
+            self.fallos_seguidos = 0
+            return
+        self.error_counter += 1
+        self.fallos_seguidos += 1
+        if self.fallos_seguidos >= PROFILE_BREAKER_FAILURES:
+            self.abierto_hasta = time.monotonic() + PROFILE_BREAKER_COOLDOWN
+            logger.warning(f"[PERFILES] {self.username} fuera de servicio {PROFILE_BREAKER_COOLDOWN:.0f}s tras {self.fallos_seguidos} fallos")
 
-    def _login(self):
+    async def login(self, client: httpx.AsyncClient):
         login_url = f"{URL_BASE}/get/login/{APP_KEY}"
         data = {"username": self.username, "password": self.password}
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
-        resp = httpx.post(login_url, data=data, headers=headers)
+        try:
+            resp = await client.post(login_url, data=data, headers=headers)
+        except httpx.RequestError as e:
+            logger.error(f"[LOGIN] Error de red para {self.username}: {e}")
+            self.valido = False
+            return self
 
         if resp.status_code != 200:
-            return
+            self.valido = False
+            return self
 
         try:
             self.sid = resp.json()["result"]["sid"]
             self.valido = True
-        except KeyError:
+        except (KeyError, TypeError, ValueError):
             self.valido = False
+        return self
+
+    async def relogin(self, client: httpx.AsyncClient, sid_caducado: str):
+        # Si varias peticiones ven el mismo SID caducado, solo la primera repite el login
+        async with self._lock:
+            if self.sid == sid_caducado:
+                logger.warning(f"[LOGIN] SID caducado para {self.username}, renovando sesión")
+                await self.login(client)
+        return self.valido
+
+
+async def crear_perfiles(client: httpx.AsyncClient, perfiles: dict) -> dict:
+    """Inicia sesión con todos los perfiles a la vez y devuelve solo los válidos."""
+    instancias = {nombre: Perfil(cred) for nombre, cred in perfiles.items()}
+    await asyncio.gather(*(p.login(client) for p in instancias.values()))
+    return {nombre: p for nombre, p in instancias.items() if p.valido}
 
 
 class GestorPerfiles:
-    def __init__(self,  instancias: dict):
+    """Reparte las llamadas entre perfiles según su salud.
+
+    Se elige el perfil disponible con menor ``puntuacion`` y que no supere
+    ``max_concurrencia`` llamadas en curso. Si todos están ocupados o con el
+    cortocircuito abierto, la petición espera a que alguno quede libre.
+    """
+
+    def __init__(self, instancias: dict, max_concurrencia: int = PROFILE_MAX_CONCURRENCY,
+                 espera_maxima: float = PROFILE_QUEUE_TIMEOUT):
         # lista de perfiles válidos
         self.instancias = list(instancias.values())
-        self.index = 0
-
-    def siguiente(self) -> Perfil:
-        if not self.instancias:
-            raise RuntimeError("No hay perfiles válidos")
-        perfil = self.instancias[self.index]
-        self.index = (self.index + 1) % len(self.instancias)
-        perfil.usage_counter += 1
-        return perfil
+        self.max_concurrencia = max_concurrencia
+        self.espera_maxima = espera_maxima
+        self.esperando = 0
+        self._libre = asyncio.Condition()
+
+    def _elegir(self, ahora: float):
+        candidatos = [
+            p for p in self.instancias
+            if p.en_curso < self.max_concurrencia and p.disponible(ahora)
+        ]
+        return min(candidatos, key=Perfil.puntuacion, default=None)
+
+    def _proxima_reapertura(self, ahora: float) -> float:
+        pendientes = [p.abierto_hasta - ahora for p in self.instancias if p.valido and p.abierto_hasta > ahora]
+        # Revisión periódica por si un perfil se libera en otro gestor tras una rotación
+        return min(pendientes + [1.0])
+
+    async def adquirir(self) -> Perfil:
+        if not any(p.valido for p in self.instancias):
+            raise SinPerfiles("No hay perfiles válidos")
+
+        loop = asyncio.get_running_loop()
+        limite = loop.time() + self.espera_maxima
+        async with self._libre:
+            while True:
+                perfil = self._elegir(time.monotonic())
+                if perfil is not None:
+                    perfil.en_curso += 1
+                    perfil.usage_counter += 1
+                    return perfil
+
+                restante = limite - loop.time()
+                if restante <= 0:
+                    raise SinPerfiles("No hay perfiles disponibles")
+                self.esperando += 1
+                try:
+                    await asyncio.wait_for(self._libre.wait(), min(restante, self._proxima_reapertura(time.monotonic())))
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self.esperando -= 1
+
+    async def liberar(self, perfil: Perfil):
+        perfil.en_curso -= 1
+        async with self._libre:
+            self._libre.notify()
+
+    @asynccontextmanager
+    async def reservar(self):
+        perfil = await self.adquirir()
+        try:
+            yield perfil
+        finally:
+            await self.liberar(perfil)
 
 
 async def obtener_enlace(client, media_id: str, is_movie: bool, season=0, episode=0):
-    if state.gestor is None:
+    gestor = state.gestor
+    if gestor is None:
         logger.error("El gestor de perfiles no está inicializado en state.")
-        return []
+        raise SinPerfiles("No hay perfiles válidos")
 
-    perfil = state.gestor.siguiente()
-    sid = perfil.sid
     tipo = 0 if is_movie else 1
-
-    url = f"{URL_BASE}/get/hash_link_v5/{APP_KEY}/{sid}/{tipo}/{media_id}"
     data = {"auth": AUTH_STR, "season": season, "episode": episode}
 
-    resp = await client.post(url, json=data)
+    async with gestor.reservar() as perfil:
+        sid = perfil.sid
+        url = f"{URL_BASE}/get/hash_link_v5/{APP_KEY}/{sid}/{tipo}/{media_id}"
+        inicio = time.monotonic()
+        try:
+            resp = await client.post(url, json=data)
+
+            if resp.status_code in SESION_CADUCADA and await perfil.relogin(client, sid):
+                url = f"{URL_BASE}/get/hash_link_v5/{APP_KEY}/{perfil.sid}/{tipo}/{media_id}"
+                resp = await client.post(url, json=data)
+        except httpx.RequestError:
+            perfil.registrar(time.monotonic() - inicio, ok=False)
+            raise
+        perfil.registrar(time.monotonic() - inicio, ok=resp.status_code == 200)
+
     if resp.status_code == 200:
         data = resp.json().get("data", [])
         return data if isinstance(data, list) else [data]
-    return []
+    # None (y no []) para distinguir un fallo de dixmax de un título sin enlaces
+    return None
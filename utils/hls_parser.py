@@ -0,0 +1,98 @@
+import re
+from typing import NamedTuple, Optional
+
+# Lista de atributos de HLS (RFC 8216 §4.2): NOMBRE=valor separados por comas;
+# los valores entre comillas pueden contener comas.
+_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+# Atributo URI de una etiqueta (#EXT-X-MEDIA, #EXT-X-KEY, #EXT-X-MAP...), sobre bytes
+URI_RE = re.compile(rb'(?<![A-Z0-9-])URI="([^"]*)"')
+
+_STREAM_INF = "#EXT-X-STREAM-INF:"
+_MEDIA = "#EXT-X-MEDIA:"
+
+
+class Variant(NamedTuple):
+    bandwidth: int
+    average_bandwidth: Optional[int]
+    width: int
+    height: int
+    codecs: Optional[str]
+    frame_rate: Optional[float]
+    audio: Optional[str]
+    uri: Optional[str]
+    line: int  # índice de la línea #EXT-X-STREAM-INF; la URI va en la siguiente
+    attributes: dict
+
+
+class Media(NamedTuple):
+    type: Optional[str]
+    group_id: Optional[str]
+    language: Optional[str]
+    name: Optional[str]
+    uri: Optional[str]
+    default: bool
+    line: int
+    attributes: dict
+
+
+class Master(NamedTuple):
+    lines: list  # líneas sin espacios alrededor, en el orden original
+    variants: list
+    media: list
+
+
+def parse_attributes(text: str) -> dict:
+    return {name: value[1:-1] if value[:1] == '"' else value for name, value in _ATTRIBUTE_RE.findall(text)}
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_master(content: str) -> Master:
+    """Recorre el master una sola vez y devuelve sus variantes y pistas #EXT-X-MEDIA."""
+    lines = [line.strip() for line in content.splitlines()]
+    last = len(lines) - 1
+    variants = []
+    media = []
+
+    for i, line in enumerate(lines):
+        if line[:18] == _STREAM_INF:
+            attrs = parse_attributes(line[18:])
+            width, _, height = attrs.get("RESOLUTION", "").partition("x")
+            average = attrs.get("AVERAGE-BANDWIDTH")
+            frame_rate = attrs.get("FRAME-RATE")
+            try:
+                frame_rate = float(frame_rate) if frame_rate else None
+            except ValueError:
+                frame_rate = None
+            variants.append(Variant(
+                _int(attrs.get("BANDWIDTH")),
+                _int(average) if average is not None else None,
+                _int(width),
+                _int(height),
+                attrs.get("CODECS"),
+                frame_rate,
+                attrs.get("AUDIO"),
+                lines[i + 1] if i < last else None,
+                i,
+                attrs,
+            ))
+
+        elif line[:13] == _MEDIA:
+            attrs = parse_attributes(line[13:])
+            media.append(Media(
+                attrs.get("TYPE"),
+                attrs.get("GROUP-ID"),
+                attrs.get("LANGUAGE"),
+                attrs.get("NAME"),
+                attrs.get("URI"),
+                attrs.get("DEFAULT") == "YES",
+                i,
+                attrs,
+            ))
+
+    return Master(lines, variants, media)
@@ -1,91 +1,262 @@
+import re
+import json
+import time
 import httpx
 import asyncio
-from urllib.parse import urljoin 
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit, quote
 from utils.logger import setup_logger
+from utils.hls_parser import URI_RE, Master, Media, Variant, parse_master
+from utils.signing import sign_url
+from utils.compression import compress, decompress
+from config import REWRITE_INLINE_MAX_BYTES, REWRITE_WORKERS
 
 logger = setup_logger(__name__)
 
-def _is_url(line):
-    return line and not line.startswith("#") and len(line.strip()) > 0
+# Cabeceras de la respuesta de un segmento que se reenvían al cliente
+SEGMENT_HEADERS = ("content-type", "content-length", "content-range", "content-encoding", "accept-ranges", "etag", "last-modified")
 
-def _cpu_bound_rewrite(content, base_url):
-    lines = content.splitlines()
+# URIs de estas etiquetas son claves o segmentos de inicialización, nunca playlists
+_SEGMENT_TAGS = (b"#EXT-X-KEY", b"#EXT-X-SESSION-KEY", b"#EXT-X-MAP")
+
+_SCHEME_RE = re.compile(rb'[A-Za-z][A-Za-z0-9+.-]*:')
+
+# Pool propio para reescribir playlists grandes: no compite con el pool por defecto
+_REWRITE_POOL = ThreadPoolExecutor(max_workers=REWRITE_WORKERS, thread_name_prefix="hls-rewrite")
+
+
+class BaseResolver:
+    """Resuelve URIs relativas contra una URL base que se analiza una sola vez.
+
+    Los casos habituales (URI absoluta, "//host/...", "/ruta" y "segmento.ts")
+    se resuelven concatenando bytes. Lo demás (".." o ".", "?query", "#frag")
+    pasa por ``urljoin`` y se memoriza.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        parts = urlsplit(base_url)
+        path = parts.path or "/"
+        self.scheme = parts.scheme.encode()
+        self.origin = f"{parts.scheme}://{parts.netloc}".encode()
+        self.directory = self.origin + path[:path.rfind("/") + 1].encode()
+        self._joined = {}
+
+    def resolve(self, uri: bytes) -> bytes:
+        if _SCHEME_RE.match(uri):
+            return uri
+        if uri[:2] == b"//":
+            return self.scheme + b":" + uri
+        if b"./" in uri or uri[-1:] == b"." or uri[:1] in (b"?", b"#"):
+            joined = self._joined.get(uri)
+            if joined is None:
+                joined = self._joined[uri] = urljoin(self.base_url, uri.decode("utf-8", "replace")).encode()
+            return joined
+        if uri[:1] == b"/":
+            return self.origin + uri
+        return self.directory + uri
+
+
+def _proxy_url(proxy_base: bytes, absolute_url: bytes, is_playlist: bool) -> bytes:
+    endpoint = b"playlist" if is_playlist else b"segment"
+    return (proxy_base + b"/proxy/" + endpoint + b"?url=" + quote(absolute_url, safe="").encode()
+            + b"&sig=" + sign_url(absolute_url).encode())
+
+def _cpu_bound_rewrite(content: bytes, base_url: str, proxy_base: str = None):
+    resolver = BaseResolver(base_url)
+    proxy = proxy_base.encode() if proxy_base else None
     rewritten_lines = []
     rewrite_count = 0
+    # En un master todas las URIs son playlists; en una media playlist, segmentos
+    is_master = b"#EXT-X-STREAM-INF" in content
 
-    for line in lines:
+    for line in content.splitlines():
         line = line.strip()
         if not line:
             rewritten_lines.append(line)
             continue
 
-        if line.startswith("#") and 'URI="' in line:
-            try:
-                start_idx = line.find('URI="') + 5
-                end_idx = line.find('"', start_idx)
-                if start_idx > 4 and end_idx > start_idx:
-                    relative_uri = line[start_idx:end_idx]
-                    absolute_url = urljoin(base_url, relative_uri)
-                    
-                    new_uri = absolute_url
-                    
-                    line = line[:start_idx] + new_uri + line[end_idx:]
-                    rewrite_count += 1
-            except Exception:
-                pass
+        if line[:1] == b"#":
+            if b'URI="' in line:
+                is_playlist = is_master and not line.startswith(_SEGMENT_TAGS)
+
+                def rewrite_uri(match):
+                    absolute_url = resolver.resolve(match.group(1))
+                    if proxy:
+                        absolute_url = _proxy_url(proxy, absolute_url, is_playlist)
+                    return b'URI="' + absolute_url + b'"'
+
+                line, count = URI_RE.subn(rewrite_uri, line)
+                rewrite_count += count
             rewritten_lines.append(line)
 
-        elif _is_url(line):
-            absolute_url = urljoin(base_url, line)
+        else:
+            absolute_url = resolver.resolve(line)
+            if proxy:
+                absolute_url = _proxy_url(proxy, absolute_url, is_master)
             rewritten_lines.append(absolute_url)
             rewrite_count += 1
-        
-        else:
-            rewritten_lines.append(line)
-    
-    return "\n".join(rewritten_lines), rewrite_count
 
-async def fetch_and_rewrite_manifest(client: httpx.AsyncClient, target_url: str):
+    return b"\n".join(rewritten_lines).decode("utf-8", "replace"), rewrite_count
+
+async def fetch_and_rewrite_manifest(client: httpx.AsyncClient, target_url: str, proxy_base: str = None,
+                                     validators: tuple = None):
+    """Descarga y reescribe una playlist.
+
+    Devuelve ``(contenido, estado, content_type, validadores)``, donde
+    ``validadores`` es ``(etag, last_modified)`` de la respuesta. Si se pasan
+    los de una copia anterior se hace un GET condicional, y un 304 devuelve
+    ``(None, 304, None, validadores)`` sin descargar ni reescribir nada.
+    """
     try:
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
             "Accept-Encoding": "gzip, deflate"
         }
+        if validators:
+            etag, last_modified = validators
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
         
-        logger.info(f"[FETCH] Downloading Master: {target_url[:60]}...")
+        logger.debug("[FETCH] Downloading Playlist: %s...", target_url[:60])
         response = await client.get(target_url, headers=headers)
+
+        if response.status_code == 304 and validators:
+            return None, 304, None, validators
         
         if response.status_code != 200:
-            return None, response.status_code, None
+            return None, response.status_code, None, None
 
         content_type = response.headers.get("content-type", "application/vnd.apple.mpegurl")
         base_url = str(response.url)
         
-        final_content, count = await asyncio.to_thread(_cpu_bound_rewrite, response.text, base_url)
-        return final_content, 200, content_type
+        content = response.content
+        if len(content) <= REWRITE_INLINE_MAX_BYTES:
+            # Un master típico se reescribe en microsegundos: el salto a un hilo costaría más
+            final_content, count = _cpu_bound_rewrite(content, base_url, proxy_base)
+        else:
+            loop = asyncio.get_running_loop()
+            final_content, count = await loop.run_in_executor(_REWRITE_POOL, _cpu_bound_rewrite, content, base_url, proxy_base)
+        return final_content, 200, content_type, (response.headers.get("etag"), response.headers.get("last-modified"))
 
     except Exception as e:
         logger.error(f"[CRITICAL] Proxy error: {e}")
-        return None, 500, None
+        return None, 500, None, None
+
+async def open_segment(client: httpx.AsyncClient, target_url: str, range_header: str = None):
+    """Abre un segmento o clave en modo streaming; quien llama debe cerrar la respuesta.
+
+    El cuerpo no se descarga aquí: se lee trozo a trozo con ``aiter_raw`` a
+    medida que el cliente consume, así que la memoria no depende del tamaño.
+    """
+    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
+    if range_header:
+        headers["Range"] = range_header
+
+    request = client.build_request("GET", target_url, headers=headers)
+    return await client.send(request, stream=True)
+
+class MasterPlaylist:
+    """Master reescrito e indexado por ancho de banda, guardado comprimido.
+
+    Al construirse lo recorre una vez con ``parse_master`` y anota qué líneas
+    forman la salida filtrada de cada BANDWIDTH y AVERAGE-BANDWIDTH. Solo se
+    conservan el master completo en ``gz``, esos índices y las variantes y
+    pistas tipadas de ``parsed`` (sin las líneas de texto). Cada salida se
+    genera, comprime y memoriza con su ETag la primera vez que se pide.
+
+    ``to_blob`` y ``from_blob`` lo guardan y recuperan sin volver a analizar
+    el texto: el gzip tal cual más los índices y las variantes en JSON.
+
+    ``validators`` son el ETag y Last-Modified del origen para revalidarlo;
+    ``fetched_at`` y ``hits`` deciden si merece refrescarse antes de caducar.
+    """
+
+    _HEADER_PREFIXES = ("#EXT-X-MEDIA", "#EXT-X-VERSION", "#EXT-X-INDEPENDENT")
+
+    def __init__(self, content: str, ctype: str = "application/vnd.apple.mpegurl",
+                 etag: str = None, last_modified: str = None, fetched_at: float = None):
+        self.ctype = ctype
+        self.validators = (etag, last_modified)
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self.hits = 0
+        self.gz = compress(content.encode())
+        parsed = parse_master(content)
+        self.parsed = parsed._replace(lines=[])
+
+        lines = parsed.lines
+        header = [i for i, line in enumerate(lines) if line.startswith(self._HEADER_PREFIXES)]
+        if lines and lines[0].startswith("#EXTM3U"):
+            header.insert(0, 0)
+
+        variants = {}  # bandwidth -> índices en parsed.lines
+        for variant in parsed.variants:
+            indices = [variant.line] if variant.uri is None else [variant.line, variant.line + 1]
+            # AVERAGE-BANDWIDTH también: las URLs generadas antes lo podían usar como bw
+            for bw in {variant.bandwidth, variant.average_bandwidth}:
+                if bw:
+                    variants.setdefault(bw, []).extend(indices)
+
+        # Un bw desconocido recibe solo las cabeceras, como antes
+        self._fallback = tuple(header)
+        # Se conserva el orden original entre cabeceras y variantes
+        self._selections = {bw: tuple(sorted(header + indices)) for bw, indices in variants.items()}
+        self._rendered = {}  # índices -> (gzip, etag)
+
+    def to_blob(self) -> bytes:
+        meta = {
+            "ctype": self.ctype,
+            "validators": self.validators,
+            "fetched_at": self.fetched_at,
+            "fallback": self._fallback,
+            "selections": list(self._selections.items()),
+            "variants": self.parsed.variants,
+            "media": self.parsed.media,
+        }
+        return json.dumps(meta).encode() + b"\n" + self.gz
+
+    @classmethod
+    def from_blob(cls, raw):
+        meta, _, gz = raw.partition(b"\n")
+        meta = json.loads(meta)
+        master = cls.__new__(cls)
+        master.ctype = meta["ctype"]
+        master.validators = tuple(meta["validators"])
+        master.fetched_at = meta["fetched_at"]
+        master.hits = 0
+        master.gz = gz
+        master.parsed = Master([], [Variant(*v) for v in meta["variants"]], [Media(*m) for m in meta["media"]])
+        master._fallback = tuple(meta["fallback"])
+        master._selections = {bw: tuple(indices) for bw, indices in meta["selections"]}
+        master._rendered = {}
+        return master
+
+    @staticmethod
+    def _render(lines, indices):
+        text = "\n".join(lines[i] for i in indices).encode()
+        return compress(text), '"' + hashlib.md5(text).hexdigest() + '"'
+
+    @property
+    def content(self) -> str:
+        return decompress(self.gz).decode()
+
+    @property
+    def nbytes(self) -> int:
+        # Crece con cada salida que se genera: la caché que lo guarda lo vuelve a medir con resize
+        return len(self.gz) + sum(len(gz) for gz, _ in self._rendered.values())
+
+    def render(self, target_bandwidth: int):
+        """Devuelve ``(gzip, etag)`` de la salida filtrada; el ETag es el del texto sin comprimir."""
+        key = self._selections.get(target_bandwidth, self._fallback)
+        rendered = self._rendered.get(key)
+        if rendered is None:
+            # Mismas líneas que vio parse_master, así que los índices siguen valiendo
+            lines = [line.strip() for line in self.content.splitlines()]
+            rendered = self._rendered[key] = self._render(lines, key)
+        return rendered
 
 def filter_manifest_by_quality(content: str, target_bandwidth: int):
-    lines = content.splitlines()
-    filtered_lines = []
-    
-    if lines and lines[0].startswith("#EXTM3U"):
-        filtered_lines.append(lines[0])
-        
-    for i, line in enumerate(lines):
-        line = line.strip()
-        
-        if line.startswith("#EXT-X-MEDIA") or line.startswith("#EXT-X-VERSION") or line.startswith("#EXT-X-INDEPENDENT"):
-            filtered_lines.append(line)
-            continue
-            
-        if line.startswith("#EXT-X-STREAM-INF"):
-            if f"BANDWIDTH={target_bandwidth}" in line:
-                filtered_lines.append(line)
-                if i + 1 < len(lines):
-                    filtered_lines.append(lines[i+1])
-    
-    return "\n".join(filtered_lines)
+    return decompress(MasterPlaylist(content).render(target_bandwidth)[0]).decode()
@@ -0,0 +1,38 @@
+import time
+import asyncio
+
+from utils.cache_backend import SQLiteCache
+
+
+class LinkStore(SQLiteCache):
+    """Caché de enlaces de dixmax acotada en memoria y persistida en SQLite.
+
+    Las lecturas se sirven desde la L1 en memoria y las escrituras se vuelcan
+    por lotes (ver SQLiteCache). Como todas las entradas usan el mismo TTL y
+    validarlas lo renueva, las de ``expires_at`` más antiguo son las validadas
+    hace más tiempo: el validador las toma directamente de la tabla, así que
+    también ve las que han guardado otros workers.
+    """
+
+    def __init__(self, path: str, maxsize: int, ttl: float, flush_interval: float = 5.0,
+                 shared: bool = False, local_ttl: float = None):
+        super().__init__(path, "links", maxsize, ttl, flush_interval, shared=shared, local_ttl=local_ttl)
+
+    def touch(self, key, urls):
+        """Marca la entrada como recién validada y renueva su TTL."""
+        self.set(key, urls)
+
+    async def least_recently_validated(self, n: int):
+        await self.flush()
+        return await asyncio.to_thread(self._least_recently_validated, n)
+
+    def _least_recently_validated(self, n: int):
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT key, value FROM links WHERE expires_at > ? ORDER BY expires_at LIMIT ?",
+                (time.time(), n),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [(key, self.decode(value)) for key, value in rows]
@@ -0,0 +1,92 @@
+import time
+import asyncio
+from urllib.parse import urlsplit
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class HostRateLimiter:
+    """Reparte las peticiones a cada host en huecos de ``1 / rate`` segundos."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next_slot = {}  # host -> instante (monotonic) del siguiente hueco libre
+
+    async def wait(self, host: str):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(self._next_slot.get(host, now), now)
+        self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class LinkValidator:
+    """Comprueba los enlaces de un LinkStore por lotes pequeños y continuos.
+
+    Cada ``run_batch`` toma las ``batch_size`` entradas validadas hace más
+    tiempo, lanza sus HEAD con un máximo de ``concurrency`` a la vez y
+    respetando ``per_host_rate`` peticiones/s por host. Las entradas vivas
+    renuevan su TTL; las que no tienen ningún enlace vivo se eliminan y se
+    notifican a ``on_dead``.
+    """
+
+    def __init__(self, client, store, concurrency: int, per_host_rate: float, batch_size: int,
+                 timeout: float = 5.0, on_dead=None):
+        self.client = client
+        self.store = store
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.on_dead = on_dead
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._limiter = HostRateLimiter(per_host_rate)
+        self._running = False
+
+        self.checked = 0
+        self.evicted = 0
+
+    async def run_batch(self):
+        # Si el lote anterior sigue en marcha no se solapa otro
+        if self._running:
+            return
+        self._running = True
+        try:
+            batch = await self.store.least_recently_validated(self.batch_size)
+            if not batch:
+                return
+            results = await asyncio.gather(*(self._check(urls) for _, urls in batch))
+
+            dead = 0
+            for (key, urls), alive in zip(batch, results):
+                if alive:
+                    self.store.touch(key, urls)
+                else:
+                    self.store.pop(key)
+                    if self.on_dead:
+                        self.on_dead(key, urls)
+                    dead += 1
+
+            self.checked += len(batch)
+            self.evicted += dead
+            if dead:
+                logger.info(f"[VALIDATOR] {len(batch)} entradas comprobadas, {dead} eliminadas.")
+        finally:
+            self._running = False
+
+    async def _check(self, urls) -> bool:
+        for url in urls:
+            if await self._head_ok(url):
+                return True
+        return False
+
+    async def _head_ok(self, url) -> bool:
+        await self._limiter.wait(urlsplit(url).hostname or "")
+        async with self._semaphore:
+            try:
+                resp = await self.client.head(url, timeout=self.timeout)
+                return resp.status_code == 200
+            except Exception:
+                return False
@@ -1,4 +1,11 @@
+import json
+import time
+import queue
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_SAMPLE_INTERVAL, LOG_QUEUE_SIZE
 
 
 class CustomFormatter(logging.Formatter):
@@ -21,31 +28,121 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + format + reset
     }
 
+    def __init__(self):
+        super().__init__()
+        # Un Formatter por nivel, creado una vez y no en cada registro
+        self._formatters = {level: logging.Formatter(fmt, "%m-%d %H:%M:%S") for level, fmt in self.FORMATS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt, "%m-%d %H:%M:%S")
+        formatter = self._formatters.get(record.levelno, self._formatters[logging.INFO])
         return formatter.format(record)
 
 
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, para agregadores de logs."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "where": f"{record.pathname}:{record.lineno}",
+            "message": record.getMessage(),
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    """Deja pasar como mucho un registro cada ``interval`` segundos por clave de muestreo.
+
+    Solo afecta a los registros emitidos con ``extra={"sample": clave}``; los
+    descartados se cuentan y se indican en el siguiente que pasa.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self._windows = {}  # clave -> [inicio de la ventana, descartados]
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None or self.interval <= 0:
+            return True
+
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is not None and now - window[0] < self.interval:
+            window[1] += 1
+            return False
+
+        self._windows[key] = [now, 0]
+        if window is not None and window[1]:
+            record.suppressed = window[1]
+            record.msg = f"{record.msg} (+{window[1]} similares omitidos)"
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler con cola acotada: si el escritor no da abasto se descarta en vez de bloquear."""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_queue_handler = None
+
+
+def _get_queue_handler():
+    # Un único hilo escribe en stderr; los loggers solo encolan
+    global _queue_handler
+    if _queue_handler is None:
+        stream = logging.StreamHandler()
+        stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else CustomFormatter())
+
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        listener = QueueListener(log_queue, stream)
+        listener.start()
+        atexit.register(listener.stop)
+
+        _queue_handler = DroppingQueueHandler(log_queue)
+        _queue_handler.addFilter(SampleFilter(LOG_SAMPLE_INTERVAL))
+    return _queue_handler
+
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def _level_for(name: str) -> str:
+    # El prefijo más largo de LOG_LEVELS gana: "utils" afecta a "utils.dixmax"
+    matches = [prefix for prefix in LOG_LEVELS if name == prefix or name.startswith(prefix + ".")]
+    return LOG_LEVELS[max(matches, key=len)] if matches else LOG_LEVEL
+
+
 def setup_logger(name):
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)  # Adjust as needed
+    logger.setLevel(_level_for(name))
 
     if len(logger.handlers) > 0:
         return logger
 
-    # Create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)  # Adjust as needed
-
-    ch.setFormatter(CustomFormatter())
-    logger.addHandler(ch)
+    logger.addHandler(_get_queue_handler())
     return logger
 
 # Example usage
 # logger = setup_logger(__name__)
 # logger.debug('This is a debug message')
 # logger.info('This is an info message')
+# logger.info('[CACHE HIT] %s...', url[:60], extra={"sample": "cache_hit"})
 # logger.warning('This is a warning message')
 # logger.error('This is an error message')
 # logger.critical('This is a critical message')
@@ -0,0 +1,213 @@
+import time
+import asyncio
+from bisect import bisect_left
+
+import httpx
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monótono con etiquetas; cada serie es una entrada del dict."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, *labels, value):
+        self._values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [contadores por bucket (+Inf al final), suma]
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _labels(self.labelnames, labels, f'le="{_number(bound)}"'), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, labels), total
+            yield f"{self.name}_count", _labels(self.labelnames, labels), cumulative
+
+
+class Registry:
+    """Métricas registradas más colectores que leen estadísticas ya existentes al exportar.
+
+    Un colector devuelve tuplas ``(name, type, help, labelnames, [(labels, value), ...])``.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, fn):
+        self._collectors.append(fn)
+        return fn
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+
+        for collect in self._collectors:
+            for name, type, help, labelnames, samples in collect():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labelnames, labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "ndkmax_upstream_request_duration_seconds",
+    "Tiempo hasta las cabeceras de respuesta de cada upstream.",
+    ("upstream", "outcome"),
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge("ndkmax_http_requests_in_flight", "Peticiones en curso por endpoint.", ("endpoint",))
+HTTP_REQUESTS = REGISTRY.counter("ndkmax_http_requests_total", "Peticiones recibidas por endpoint y estado.", ("endpoint", "status"))
+HTTP_LATENCY = REGISTRY.histogram("ndkmax_http_request_duration_seconds", "Duración de las peticiones por endpoint.", ("endpoint",))
+LOOP_LAG = REGISTRY.histogram(
+    "ndkmax_event_loop_lag_seconds",
+    "Retraso del bucle de eventos respecto a un temporizador periódico.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Transporte httpx que mide la latencia de cada petición según ``classify(url)``."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, classify):
+        self.transport = transport
+        self.classify = classify
+
+    async def handle_async_request(self, request):
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start, self.classify(request.url), "error")
+            raise
+        outcome = "ok" if response.status_code < 400 else str(response.status_code)
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, self.classify(request.url), outcome)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class MetricsMiddleware:
+    """Middleware ASGI mínimo: peticiones en curso, totales y duración por endpoint.
+
+    El endpoint se toma del prefijo de la ruta para no crear una serie por URL.
+    """
+
+    def __init__(self, app, endpoints):
+        self.app = app
+        self.endpoints = tuple(endpoints)
+
+    def _endpoint(self, path: str) -> str:
+        for prefix in self.endpoints:
+            if path.startswith(prefix):
+                return prefix
+        return "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        endpoint = self._endpoint(path)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(endpoint)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(endpoint)
+            HTTP_LATENCY.observe(time.perf_counter() - start, endpoint)
+            HTTP_REQUESTS.inc(endpoint, str(status[0]))
+
+
+async def monitor_loop_lag(interval: float = 0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(loop.time() - start - interval, 0.0))
@@ -0,0 +1,112 @@
+import math
+import time
+import hashlib
+
+
+def bloom_dimensions(capacity: int, error_rate: float):
+    """Bits y número de hashes de un filtro para ``capacity`` claves con ``error_rate`` de falsos positivos."""
+    size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    return size, max(1, round(size / capacity * math.log(2)))
+
+
+def bloom_positions(key: str, size: int, hashes: int):
+    # Doble hashing: k posiciones a partir de un único blake2b de 128 bits
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % size for i in range(hashes)]
+
+
+class BloomFilter:
+    """Filtro de Bloom sobre un bytearray de ``size`` bits; se consulta con posiciones ya calculadas."""
+
+    def __init__(self, size: int):
+        self.bits = bytearray((size + 7) // 8)
+        self.count = 0
+
+    def add(self, positions):
+        bits = self.bits
+        for pos in positions:
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def contains(self, positions) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in positions)
+
+
+class _Generations:
+    """Dos filtros que rotan cada ``ttl``: una clave se recuerda entre ``ttl`` y ``2 * ttl``."""
+
+    def __init__(self, ttl: float, capacity: int, size: int):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.size = size
+        self.current = BloomFilter(size)
+        self.previous = None
+        self.rotated_at = time.monotonic()
+
+    def _rotate(self):
+        now = time.monotonic()
+        elapsed = now - self.rotated_at
+        # También se rota al llenarse, para que los falsos positivos no pasen de error_rate
+        if elapsed < self.ttl and self.current.count < self.capacity:
+            return
+        self.previous = self.current if elapsed < 2 * self.ttl else None
+        self.current = BloomFilter(self.size)
+        # Se mantiene el calendario de rotación aunque se compruebe tarde
+        self.rotated_at = self.rotated_at + self.ttl if self.ttl <= elapsed < 2 * self.ttl else now
+
+    def add(self, positions):
+        self._rotate()
+        if not self.current.contains(positions):
+            self.current.add(positions)
+
+    def contains(self, positions) -> bool:
+        self._rotate()
+        if self.current.contains(positions):
+            return True
+        return self.previous is not None and self.previous.contains(positions)
+
+    def __len__(self):
+        return self.current.count + (self.previous.count if self.previous is not None else 0)
+
+
+class NegativeCache:
+    """Recuerda claves que fallaron, con un TTL corto según el tipo de fallo.
+
+    Cada tipo (``ttls``: tipo -> segundos) guarda sus claves en filtros de
+    Bloom que rotan por generaciones, así que millones de claves ocupan unos
+    pocos MB y no hay nada que expulsar. A cambio no se puede borrar una
+    clave y hay una tasa pequeña de falsos positivos, que como mucho retrasan
+    un título durante su TTL.
+    """
+
+    def __init__(self, ttls: dict, capacity: int, error_rate: float = 0.001):
+        self._size, self._hashes = bloom_dimensions(capacity, error_rate)
+        self._kinds = {kind: _Generations(ttl, capacity, self._size) for kind, ttl in ttls.items() if ttl > 0}
+        self.hits = {kind: 0 for kind in ttls}
+        self.misses = 0
+
+    def add(self, kind: str, key: str):
+        generations = self._kinds.get(kind)
+        if generations is not None:
+            generations.add(bloom_positions(key, self._size, self._hashes))
+
+    def get(self, key: str):
+        """Devuelve el tipo de fallo recordado para ``key`` o None."""
+        if not self._kinds:
+            return None
+        positions = bloom_positions(key, self._size, self._hashes)
+        for kind, generations in self._kinds.items():
+            if generations.contains(positions):
+                self.hits[kind] += 1
+                return kind
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            f"negative_{kind}": {"hits": self.hits[kind], "size": len(generations)}
+            for kind, generations in self._kinds.items()
+        }
@@ -0,0 +1,83 @@
+import asyncio
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+async def wait_idle(is_busy, max_wait: float):
+    """Espera mientras ``is_busy()`` sea cierto, como mucho ``max_wait`` segundos."""
+    loop = asyncio.get_running_loop()
+    until = loop.time() + max_wait
+    while is_busy() and loop.time() < until:
+        await asyncio.sleep(0.05)
+
+
+class Prefetcher:
+    """Cola de trabajos de precarga en segundo plano con concurrencia fija.
+
+    Cada trabajo tiene una clave: mientras está en cola o en curso no se
+    vuelve a aceptar. Si la cola está llena el trabajo se descarta. Antes de
+    empezar uno, el worker cede el paso mientras ``is_busy()`` sea cierto
+    (tráfico en directo), hasta ``max_wait`` segundos para no quedar parado.
+    """
+
+    def __init__(self, concurrency: int, queue_size: int, is_busy=None, max_wait: float = 2.0):
+        self.concurrency = concurrency
+        self.is_busy = is_busy or (lambda: False)
+        self.max_wait = max_wait
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._keys = set()
+        self._workers = []
+
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def submit(self, key, factory) -> bool:
+        if key in self._keys:
+            return False
+        try:
+            self._queue.put_nowait((key, factory))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self._keys.add(key)
+        self.submitted += 1
+        return True
+
+    async def start(self):
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    async def _worker(self):
+        while True:
+            key, factory = await self._queue.get()
+            try:
+                await wait_idle(self.is_busy, self.max_wait)
+                await factory()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"[PREFETCH] Fallo precargando {key}: {e}")
+            finally:
+                self._keys.discard(key)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
@@ -0,0 +1,17 @@
+import hmac
+import hashlib
+
+from config import PROXY_SECRET
+
+_KEY = PROXY_SECRET.encode()
+
+
+def sign_url(url) -> str:
+    """Firma (HMAC-SHA256 truncado a 128 bits) de una URL que el addon acepta en /proxy/*."""
+    if isinstance(url, str):
+        url = url.encode()
+    return hmac.new(_KEY, url, hashlib.sha256).hexdigest()[:32]
+
+
+def verify_url(url: str, signature: str) -> bool:
+    return bool(signature) and hmac.compare_digest(sign_url(url), signature)
@@ -1,73 +1,70 @@
-import re
 from urllib.parse import quote
 from utils.logger import setup_logger
+from utils.hls_parser import Master, parse_master
+from utils.signing import sign_url
 from config import ADDON_URL
 
 logger = setup_logger(__name__)
 
+EMOJIS = {
+    "en": "🇬🇧", "eng": "🇬🇧", "english": "🇬🇧",
+    "es": "🇪🇸", "spa": "🇪🇸", "spanish": "🇪🇸", "castellano": "🇪🇸",
+    "lat": "🇲🇽", "mx": "🇲🇽", "latino": "🇲🇽", "et": "🇲🇽",
+    "jp": "🇯🇵", "jpn": "🇯🇵",
+    "fr": "🇫🇷", "fra": "🇫🇷",
+    "it": "🇮🇹", "ita": "🇮🇹",
+    "de": "🇩🇪", "deu": "🇩🇪",
+    "pt": "🇵🇹", "por": "🇵🇹",
+    "ru": "🇷🇺", "rus": "🇷🇺",
+    "multi": "🌎"
+}
+
 def get_emoji(lang_code):
-    lang_code = lang_code.lower().strip()
-    mapping = {
-        "en": "🇬🇧", "eng": "🇬🇧", "english": "🇬🇧",
-        "es": "🇪🇸", "spa": "🇪🇸", "spanish": "🇪🇸", "castellano": "🇪🇸",
-        "lat": "🇲🇽", "mx": "🇲🇽", "latino": "🇲🇽", "et": "🇲🇽",
-        "jp": "🇯🇵", "jpn": "🇯🇵",
-        "fr": "🇫🇷", "fra": "🇫🇷",
-        "it": "🇮🇹", "ita": "🇮🇹",
-        "de": "🇩🇪", "deu": "🇩🇪",
-        "pt": "🇵🇹", "por": "🇵🇹",
-        "ru": "🇷🇺", "rus": "🇷🇺",
-        "multi": "🌎"
-    }
-    return mapping.get(lang_code, "")
+    return EMOJIS.get(lang_code.lower().strip(), "")
 
-def parse_manifest_to_qualities(master_url: str, content_title: str, duration: float, content: str):
+def parse_manifest_to_qualities(master_url: str, content_title: str, duration: float, content: str = None, parsed: Master = None):
     try:
-        lines = content.split('\n')
+        master = parsed or parse_master(content)
         streams_found = []
-        
-        audio_langs = re.findall(r'TYPE=AUDIO.*LANGUAGE="?(\w+)"?', content)
-        unique_langs = list(set(audio_langs))
-        emojis = [get_emoji(l) for l in unique_langs if get_emoji(l)]
+
+        # "es-419" -> "es"; el orden no importa, solo las banderas distintas
+        unique_langs = {m.language.split("-")[0] for m in master.media if m.type == "AUDIO" and m.language}
+        emojis = [emoji for emoji in map(get_emoji, unique_langs) if emoji]
         flags_str = " / ".join(emojis) if emojis else "🇪🇸"
 
         base_addon_url = str(ADDON_URL).rstrip('/')
+        quoted_master = quote(master_url)
+        signature = sign_url(master_url)
+        spacer = "\u2800" * 2
+
+        for variant in master.variants:
+            height = variant.height
+            bandwidth = variant.bandwidth
+
+            if bandwidth > 0:
+                quality_label = f"{height}p" if height > 0 else "Auto"
+
+                size_info = ""
+                if duration > 0:
+                    size_bits = bandwidth * (duration * 60)
+                    size_gb = size_bits / 8 / (1024 ** 3)
+                    size_info = f"💾 {size_gb:.2f}GB "
 
-        for i, line in enumerate(lines):
-            line = line.strip()
-            
-            if line.startswith("#EXT-X-STREAM-INF"):
-                res_match = re.search(r'RESOLUTION=\d+x(\d+)', line)
-                bw_match = re.search(r'BANDWIDTH=(\d+)', line)
-                
-                height = int(res_match.group(1)) if res_match else 0
-                bandwidth = int(bw_match.group(1)) if bw_match else 0
-                
-                if bandwidth > 0:
-                    quality_label = f"{height}p" if height > 0 else "Auto"
-                    
-                    size_info = ""
-                    if duration > 0:
-                        size_bits = bandwidth * (duration * 60)
-                        size_gb = size_bits / 8 / (1024 ** 3)
-                        size_info = f"💾 {size_gb:.2f}GB "
+                name_formatted = f"NDKMAX{spacer} {quality_label}"
+                title_formatted = f"{content_title} - {quality_label}\n{size_info}\n{flags_str}"
 
-                    spacer = "\u2800" * 2
-                    name_formatted = f"NDKMAX{spacer} {quality_label}"
-                    title_formatted = f"{content_title} - {quality_label}\n{size_info}\n{flags_str}"
-                    
-                    generated_url = f"{base_addon_url}/proxy/filter?url={quote(master_url)}&bw={bandwidth}"
+                generated_url = f"{base_addon_url}/proxy/filter?url={quoted_master}&bw={bandwidth}&sig={signature}"
 
-                    stream_entry = {
-                        "name": name_formatted,
-                        "title": title_formatted,
-                        "url": generated_url,
-                        "behaviorHints": {
-                            "notWebReady": False,
-                            "bingeGroup": f"NDK-MAX-{quality_label}",
-                        }
+                stream_entry = {
+                    "name": name_formatted,
+                    "title": title_formatted,
+                    "url": generated_url,
+                    "behaviorHints": {
+                        "notWebReady": False,
+                        "bingeGroup": f"NDK-MAX-{quality_label}",
                     }
-                    streams_found.append(stream_entry)
+                }
+                streams_found.append((height, stream_entry))
 
         if not streams_found:
              return [{
@@ -76,8 +73,8 @@ def parse_manifest_to_qualities(master_url: str, content_title: str, duration: f
                 "url": master_url
             }]
 
-        streams_found.sort(key=lambda x: int(x['name'].split()[-1].replace('p', '')) if 'p' in x['name'] else 0, reverse=True)
-        return streams_found
+        streams_found.sort(key=lambda x: x[0], reverse=True)
+        return [entry for _, entry in streams_found]
 
     except Exception as e:
         logger.error(f"Error parseando HLS streams: {e}")
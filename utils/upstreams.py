@@ -0,0 +1,234 @@
+import socket
+import asyncio
+import ipaddress
+import contextlib
+
+import httpx
+import httpcore
+
+from utils.cache import TTLCache, SingleFlight
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# Errores de httpcore y su equivalente en httpx, de los más concretos a los más generales
+_HTTPX_ERRORS = (
+    (httpcore.ConnectTimeout, httpx.ConnectTimeout),
+    (httpcore.ReadTimeout, httpx.ReadTimeout),
+    (httpcore.WriteTimeout, httpx.WriteTimeout),
+    (httpcore.PoolTimeout, httpx.PoolTimeout),
+    (httpcore.TimeoutException, httpx.TimeoutException),
+    (httpcore.ConnectError, httpx.ConnectError),
+    (httpcore.ReadError, httpx.ReadError),
+    (httpcore.WriteError, httpx.WriteError),
+    (httpcore.NetworkError, httpx.NetworkError),
+    (httpcore.ProxyError, httpx.ProxyError),
+    (httpcore.UnsupportedProtocol, httpx.UnsupportedProtocol),
+    (httpcore.RemoteProtocolError, httpx.RemoteProtocolError),
+    (httpcore.LocalProtocolError, httpx.LocalProtocolError),
+    (httpcore.ProtocolError, httpx.ProtocolError),
+)
+
+
+@contextlib.contextmanager
+def _httpx_errors(request: httpx.Request):
+    """Traduce los errores de httpcore a los de httpx, que son los que captura el resto del código."""
+    try:
+        yield
+    except Exception as e:
+        for source, target in _HTTPX_ERRORS:
+            if isinstance(e, source):
+                raise target(str(e), request=request) from e
+        raise
+
+
+class _ResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream, request: httpx.Request):
+        self._stream = stream
+        self._request = request
+
+    async def __aiter__(self):
+        with _httpx_errors(self._request):
+            async for part in self._stream:
+                yield part
+
+    async def aclose(self):
+        if hasattr(self._stream, "aclose"):
+            await self._stream.aclose()
+
+
+class CachingDNSBackend(httpcore.AsyncNetworkBackend):
+    """Backend de red de httpcore que memoriza las resoluciones DNS durante ``ttl`` segundos.
+
+    Conecta a la IP ya resuelta; httpcore sigue usando el nombre del origen
+    para el SNI del TLS, así que los certificados se validan igual. Si ninguna
+    dirección responde, la entrada se olvida y la siguiente conexión resuelve
+    de nuevo.
+    """
+
+    def __init__(self, backend: httpcore.AsyncNetworkBackend, ttl: float, maxsize: int = 1000):
+        self.backend = backend
+        self._cache = TTLCache(maxsize, ttl)
+        self._flight = SingleFlight()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    async def _resolve(self, host: str, port: int, timeout: float = None):
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+
+        key = (host, port)
+        addresses = self._cache.get(key)
+        if addresses is None:
+            addresses = await self._flight.do(key, lambda: self._lookup(host, port, timeout))
+            self._cache.set(key, addresses)
+        return addresses
+
+    async def _lookup(self, host: str, port: int, timeout: float = None):
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(loop.getaddrinfo(host, port, type=socket.SOCK_STREAM), timeout)
+        except asyncio.TimeoutError:
+            raise httpcore.ConnectTimeout(f"DNS sin respuesta para {host}")
+        except OSError as e:
+            raise httpcore.ConnectError(str(e))
+        # Sin duplicados y en el orden del resolvedor
+        return list(dict.fromkeys(info[4][0] for info in infos))
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        addresses = await self._resolve(host, port, timeout)
+        error = None
+        for address in addresses:
+            try:
+                return await self.backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        self._cache.pop((host, port))
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds):
+        await self.backend.sleep(seconds)
+
+
+class KnownHosts:
+    """Hosts de CDN que el addon conoce: los configurados y los de sus propios enlaces.
+
+    Solo ellos tienen etiqueta de métricas propia; el resto cuenta como
+    ``cdn:other``. Fuera de los configurados se admiten como mucho
+    ``maxsize`` (se quedan los primeros), así que el número de series está
+    acotado aunque un cliente pida URLs arbitrarias.
+    """
+
+    def __init__(self, hosts=(), maxsize: int = 100):
+        self.maxsize = len(hosts) + maxsize
+        self._hosts = set(hosts)
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def __contains__(self, host):
+        return host in self._hosts
+
+    def add(self, host: str):
+        if host and len(self._hosts) < self.maxsize:
+            self._hosts.add(host)
+
+
+class UpstreamPool:
+    """Límites y timeouts de una clase de upstream."""
+
+    def __init__(self, max_connections: int, timeout: httpx.Timeout, keepalive_expiry: float = 30):
+        self.limits = httpx.Limits(
+            max_keepalive_connections=max_connections,
+            max_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+
+
+class UpstreamTransport(httpx.AsyncBaseTransport):
+    """Transporte httpx que da a cada upstream su propio pool de conexiones.
+
+    ``route(url)`` devuelve ``(clave, clase)``: la clave identifica el pool
+    (p. ej. un host de CDN) y la clase elige su configuración en ``pools``.
+    Así un CDN lento no agota las conexiones de TMDB ni de dixmax. Los pools
+    de httpcore se crean aquí al primer uso, con la caché DNS como backend de
+    red; HTTP/2 se activa solo para los hosts de ``http2_hosts``. Cuántos hay
+    depende de las claves que devuelva ``route``, que deben estar acotadas.
+    """
+
+    def __init__(self, route, pools: dict, default_timeout: httpx.Timeout, http2_hosts=(),
+                 dns_ttl: float = 300, verify=True):
+        self.route = route
+        self.pools = pools
+        self.default_timeout = default_timeout.as_dict()
+        self.http2_hosts = set(http2_hosts)
+        self.ssl_context = httpx.create_ssl_context(verify=verify)
+        self.dns = CachingDNSBackend(httpcore.AnyIOBackend(), dns_ttl) if dns_ttl > 0 else None
+        self._pools = {}
+
+        if self.http2_hosts and not HTTP2_AVAILABLE:
+            logger.warning("[UPSTREAMS] UPSTREAM_HTTP2_HOSTS definido pero falta el paquete h2: se usa HTTP/1.1")
+
+    def _pool(self, key: str, pool: UpstreamPool, host: str) -> httpcore.AsyncConnectionPool:
+        connection_pool = self._pools.get(key)
+        if connection_pool is None:
+            connection_pool = self._pools[key] = httpcore.AsyncConnectionPool(
+                ssl_context=self.ssl_context,
+                max_connections=pool.limits.max_connections,
+                max_keepalive_connections=pool.limits.max_keepalive_connections,
+                keepalive_expiry=pool.limits.keepalive_expiry,
+                http2=HTTP2_AVAILABLE and host in self.http2_hosts,
+                network_backend=self.dns,
+            )
+        return connection_pool
+
+    async def handle_async_request(self, request):
+        key, kind = self.route(request.url)
+        pool = self.pools[kind]
+        # Solo se cambia el timeout por defecto del cliente; uno explícito en la petición se respeta
+        if request.extensions.get("timeout") == self.default_timeout:
+            request.extensions["timeout"] = pool.timeout.as_dict()
+
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(
+                scheme=request.url.raw_scheme,
+                host=request.url.raw_host,
+                port=request.url.port,
+                target=request.url.raw_path,
+            ),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        )
+        with _httpx_errors(request):
+            response = await self._pool(key, pool, request.url.host).handle_async_request(core_request)
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=_ResponseStream(response.stream, request),
+            extensions=response.extensions,
+        )
+
+    def stats(self) -> dict:
+        return {"pools": len(self._pools), "dns": self.dns.stats() if self.dns is not None else {}}
+
+    async def aclose(self):
+        pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            await pool.aclose()
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+
+from utils.logger import setup_logger
+from utils.prefetch import wait_idle
+
+logger = setup_logger(__name__)
+
+
+def _range(text: str) -> range:
+    start, _, end = text.partition("-")
+    return range(int(start), int(end or start) + 1)
+
+
+def parse_targets(lines) -> list:
+    """Interpreta la lista de títulos a precalentar, uno por línea.
+
+    ``tt123`` es una película; ``tt123:2`` o ``tt123:1-3`` son temporadas
+    completas; ``tt123:2:5`` o ``tt123:2:1-8`` son episodios concretos. Las
+    líneas vacías y las que empiezan por ``#`` se ignoran. Devuelve tuplas
+    ``(imdb_id, temporadas, episodios)`` con ``None`` donde no aplica.
+    """
+    targets = []
+    for number, line in enumerate(lines, 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        parts = line.split(":")
+        try:
+            if len(parts) == 1:
+                targets.append((parts[0], None, None))
+            elif len(parts) == 2:
+                targets.append((parts[0], _range(parts[1]), None))
+            elif len(parts) == 3:
+                targets.append((parts[0], _range(parts[1]), _range(parts[2])))
+            else:
+                raise ValueError(line)
+        except ValueError:
+            logger.warning(f"[WARM] Línea {number} no válida: {line}")
+    return targets
+
+
+async def expand_targets(targets, metadata_provider) -> list:
+    """Convierte los objetivos en claves de /stream; las temporadas completas usan el índice de TMDB."""
+    keys = []
+    for imdb_id, seasons, episodes in targets:
+        if seasons is None:
+            keys.append(("movie", imdb_id))
+            continue
+        for season in seasons:
+            if episodes is not None:
+                keys.extend(("series", f"{imdb_id}:{season}:{episode}") for episode in episodes)
+                continue
+            media = await metadata_provider.get_metadata(f"{imdb_id}:{season}:1", "series")
+            season_index = await metadata_provider.get_season(media.id, season) if media else None
+            if not season_index:
+                logger.warning(f"[WARM] Sin episodios en TMDB para {imdb_id} temporada {season}")
+                continue
+            keys.extend(("series", f"{imdb_id}:{season}:{episode}") for episode in sorted(season_index))
+    # Sin duplicados y en el orden de la lista
+    return list(dict.fromkeys(keys))
+
+
+class CacheWarmer:
+    """Recorre una lista de claves de /stream llamando a ``warm(type, id)`` con concurrencia fija.
+
+    ``warm`` devuelve si el título ha quedado en caché con streams. Cada clave
+    terminada se anota en ``state_path``: si el trabajo se interrumpe, la
+    siguiente ejecución con la misma lista continúa donde se quedó, y al
+    completarse el fichero se borra. Como el Prefetcher, antes de cada título
+    se cede el paso mientras ``is_busy()`` (hasta ``max_wait`` segundos).
+    """
+
+    def __init__(self, warm, concurrency: int, state_path: str = None, is_busy=None, max_wait: float = 2.0):
+        self.warm = warm
+        self.concurrency = concurrency
+        self.state_path = state_path
+        self.is_busy = is_busy or (lambda: False)
+        self.max_wait = max_wait
+
+    def _load_state(self, job: str) -> set:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return set()
+        with open(self.state_path) as f:
+            lines = f.read().splitlines()
+        try:
+            header = json.loads(lines[0]) if lines else None
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get("job") != job:
+            return set()
+
+        done = set()
+        for line in lines[1:]:
+            # Si el proceso murió a mitad de escritura la última línea queda cortada: se ignora
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, list) and len(entry) == 2:
+                done.add(tuple(entry))
+        return done
+
+    def _write_header(self, job: str):
+        with open(self.state_path, "w") as f:
+            f.write(json.dumps({"job": job}) + "\n")
+
+    def _append_state(self, lines: list):
+        with open(self.state_path, "a") as f:
+            f.write("".join(json.dumps(line) + "\n" for line in lines))
+
+    async def run(self, keys: list) -> dict:
+        job = hashlib.sha1(json.dumps(keys).encode()).hexdigest()
+        done = await asyncio.to_thread(self._load_state, job) if self.state_path else set()
+        if self.state_path and not done:
+            await asyncio.to_thread(self._write_header, job)
+
+        pending = [key for key in keys if tuple(key) not in done]
+        report = {"total": len(keys), "resumed": len(keys) - len(pending), "warmed": 0, "covered": 0, "failed": 0}
+        if done:
+            logger.info(f"[WARM] Reanudando: {report['resumed']} de {len(keys)} ya hechos")
+
+        queue = asyncio.Queue()
+        for key in pending:
+            queue.put_nowait(key)
+        start = time.monotonic()
+
+        async def worker():
+            while True:
+                try:
+                    stream_type, stream_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await wait_idle(self.is_busy, self.max_wait)
+                try:
+                    covered = await self.warm(stream_type, stream_id)
+                except Exception as e:
+                    logger.warning(f"[WARM] Error en {stream_type}/{stream_id}: {e}")
+                    report["failed"] += 1
+                    continue
+                report["warmed"] += 1
+                report["covered"] += bool(covered)
+                if self.state_path:
+                    await asyncio.to_thread(self._append_state, [[stream_type, stream_id]])
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(pending)) or 1)))
+
+        elapsed = time.monotonic() - start
+        report["elapsed"] = round(elapsed, 2)
+        report["throughput"] = round(report["warmed"] / elapsed, 2) if elapsed else 0.0
+        processed = report["warmed"] + report["failed"]
+        report["coverage"] = round(report["covered"] / report["warmed"], 4) if report["warmed"] else 0.0
+        logger.info(
+            f"[WARM] {processed} títulos en {report['elapsed']}s ({report['throughput']}/s), "
+            f"{report['covered']} con streams, {report['failed']} fallidos"
+        )
+
+        # Completo (los fallidos se reintentan en la próxima ejecución programada, no al reanudar)
+        if self.state_path and os.path.exists(self.state_path):
+            await asyncio.to_thread(os.remove, self.state_path)
+        return report
@@ -0,0 +1,68 @@
+"""Precalienta las cachés de un servidor en marcha con una lista de títulos populares.
+
+    python warm.py titulos.txt [--server URL] [--concurrency N]
+
+Cada línea es ``tt123`` (película), ``tt123:1-3`` (temporadas completas) o
+``tt123:2:1-8`` (episodios). Las temporadas completas se expanden con el
+índice de TMDB y cada título se pide a ``/stream`` del servidor (por defecto
+ADDON_URL), así que quedan en las cachés del proceso que sirve el tráfico y
+no en las de este. El servidor aplica su control de admisión: un 429 o 503
+se reintenta tras el Retry-After. Si se interrumpe, la siguiente ejecución
+con la misma lista continúa donde se quedó.
+"""
+import json
+import argparse
+import asyncio
+
+import httpx
+
+from metadata.tmdb import TMDB
+from metadata.cache import CachedMetadataProvider
+from utils.warmer import CacheWarmer, parse_targets, expand_targets
+from config import ADDON_URL, METADATA_CACHE_TTL, METADATA_CACHE_SIZE, STREAM_DEADLINE
+from config import WARM_CONCURRENCY, WARM_STATE_PATH, WARM_REPORT_PATH
+
+# Reintentos de un título rechazado por el servidor (429/503) antes de darlo por fallido
+MAX_ATTEMPTS = 5
+
+
+def stream_warmer(client: httpx.AsyncClient, server: str):
+    async def warm(stream_type: str, stream_id: str) -> bool:
+        url = f"{server}/stream/{stream_type}/{stream_id}.json"
+        for _ in range(MAX_ATTEMPTS):
+            resp = await client.get(url)
+            if resp.status_code not in (429, 503):
+                break
+            await asyncio.sleep(float(resp.headers.get("retry-after", 1)))
+        resp.raise_for_status()
+        return bool(resp.json().get("streams"))
+    return warm
+
+
+async def run(targets_path: str, server: str, concurrency: int):
+    with open(targets_path) as f:
+        targets = parse_targets(f.readlines())
+
+    async with httpx.AsyncClient(timeout=STREAM_DEADLINE * 3, follow_redirects=True) as client:
+        metadata_provider = CachedMetadataProvider(TMDB(client), ttl=METADATA_CACHE_TTL, maxsize=METADATA_CACHE_SIZE)
+        keys = await expand_targets(targets, metadata_provider)
+        warmer = CacheWarmer(stream_warmer(client, server), concurrency, WARM_STATE_PATH)
+        report = await warmer.run(keys)
+
+    with open(WARM_REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalienta las cachés de NDKMAX")
+    parser.add_argument("targets", help="fichero con un título por línea")
+    parser.add_argument("--server", default=ADDON_URL, help="URL base del addon (por defecto ADDON_URL)")
+    parser.add_argument("--concurrency", type=int, default=WARM_CONCURRENCY)
+    args = parser.parse_args()
+    if not args.server:
+        parser.error("indica --server o define ADDON_URL")
+
+    report = asyncio.run(run(args.targets, args.server.rstrip("/"), args.concurrency))
+    print(f"{report['warmed']}/{report['total'] - report['resumed']} títulos, "
+          f"{report['coverage']:.0%} con streams, {report['throughput']}/s (informe en {WARM_REPORT_PATH})")